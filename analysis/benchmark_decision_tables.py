@@ -0,0 +1,95 @@
+# Benchmark of the JCVI group and eligibility date rule tables
+#
+# Times vax_cat_jcvi_group and vax_date_eligible over a synthetic prelim
+# population, evaluated rule by rule (expressions.evaluate_categories()) and
+# as compiled decision tables (decision_tables.py), and checks that both give
+# the same categories. The rules are read from output/vax_jcvi_groups.csv.gz
+# and output/vax_eligible_dates.csv.gz, so run from the project root after
+# the vax_jcvi_groups action:
+#   python analysis/benchmark_decision_tables.py [<population>] [--repeat <n>]
+
+import csv
+import gzip
+import sys
+import time
+
+import numpy as np
+
+from decision_tables import compile_decision_table, evaluate_decision_table
+from expressions import evaluate_categories, parse, referenced_columns
+
+rule_files = {
+    "vax_cat_jcvi_group": ("output/vax_jcvi_groups.csv.gz", "group", "definition"),
+    "vax_date_eligible": ("output/vax_eligible_dates.csv.gz", "date", "description"),
+}
+
+default_population = 200_000
+
+
+def read_rules(path, key, value):
+    with gzip.open(path, "rt", newline="") as f:
+        return {row[key]: row[value] for row in csv.DictReader(f)}
+
+
+def synthetic_inputs(rules, size, rng):
+    """
+    columns for the variables the rules refer to: ages from 0 to 104 and
+    flags set for 10% of patients
+    """
+    columns, kinds = {}, {}
+    for expression in rules.values():
+        if expression.strip() == "DEFAULT":
+            continue
+        for name in referenced_columns(parse(expression)):
+            if name in columns or name in rule_files:
+                continue
+            if "age" in name:
+                columns[name] = rng.integers(0, 105, size)
+            else:
+                columns[name] = (rng.random(size) < 0.1).astype(np.int64)
+            kinds[name] = "int"
+    return columns, kinds
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(population=default_population, repeat=3):
+    rng = np.random.default_rng(123456)
+    columns, kinds = {}, {}
+    for variable, (path, key, value) in rule_files.items():
+        rules = read_rules(path, key, value)
+        inputs, input_kinds = synthetic_inputs(rules, population, rng)
+        columns.update(inputs)
+        kinds.update(input_kinds)
+        table = compile_decision_table(rules)
+        rule_by_rule, expected = best_time(lambda: evaluate_categories(rules, columns, kinds, population), repeat)
+        decision_table, result = best_time(
+            lambda: evaluate_decision_table(rules, columns, kinds, population), repeat
+        )
+        if not np.array_equal(expected, result):
+            raise AssertionError(f"Decision table for {variable} does not match rule-by-rule evaluation")
+        print(
+            f"{variable:20} {len(rules)} rules, {len(table.atoms)} distinct conditions, "
+            f"{population} patients: rule by rule {rule_by_rule:.4f}s, "
+            f"decision table {decision_table:.4f}s ({rule_by_rule / decision_table:.1f}x)"
+        )
+        # the eligibility rules refer to the JCVI group
+        columns[variable] = result
+        kinds[variable] = "str"
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    repeat = 3
+    if "--repeat" in arguments:
+        position = arguments.index("--repeat")
+        repeat = int(arguments[position + 1])
+        del arguments[position : position + 2]
+    main(int(arguments[0]) if arguments else default_population, repeat)
@@ -0,0 +1,231 @@
+# Benchmarks of the study definition modules
+#
+# For each study definition, in a fresh interpreter: the time to import the
+# module (less the time to import cohortextractor itself), the part of that
+# spent constructing the StudyDefinition, the peak memory allocated by
+# Python during the import (traced in a second interpreter, so as not to
+# slow down the timed import), the number of variables (those written, as
+# top-level, and in all, including hidden ones) and the size of the query plan: the number of event
+# queries, the number of table scans once fused (see query_planner.py) and,
+# where cohortextractor can render it, the length of the generated SQL.
+#
+# Each run is appended as one JSON line to a history file, tagged with the
+# git commit, so that runs on different commits can be compared:
+#   python analysis/benchmark_study_definitions.py [<study definition> ...] [--history <file>] [--repeat <n>]
+#   python analysis/benchmark_study_definitions.py --compare [--history <file>]
+# Run from the project root (the study definitions read output/ and
+# codelists/ relative to it).
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from import_budget import analysis_directory, run_python
+
+study_definitions = [
+    "study_definition_prelim",
+    "study_definition_prevax",
+    "study_definition_prevax_extf",
+    "study_definition_unvax",
+    "study_definition_unvax_extf",
+    "study_definition_vax",
+]
+
+default_history = "output/benchmarks/study_definitions.jsonl"
+
+# Measurements compared between runs, with the increase reported as notable
+compared_measurements = {
+    "import_seconds": 0.10,
+    "construction_seconds": 0.10,
+    "peak_memory_mb": 0.10,
+    "variables": 0,
+    "event_queries": 0,
+    "fused_scans": 0,
+    "sql_characters": 0,
+}
+
+
+def import_study(study_definition):
+    """
+    import a study definition in this interpreter (which should have imported
+    nothing of the project yet), returning the module, the time to import it
+    and the part of that spent constructing the StudyDefinition
+    """
+    import cohortextractor
+
+    construction = []
+    study_class = cohortextractor.StudyDefinition
+    original_init = study_class.__init__
+
+    def timed_init(self, *args, **kwargs):
+        start = time.perf_counter()
+        original_init(self, *args, **kwargs)
+        construction.append(time.perf_counter() - start)
+
+    study_class.__init__ = timed_init
+    start = time.perf_counter()
+    module = __import__(study_definition)
+    import_seconds = time.perf_counter() - start
+    study_class.__init__ = original_init
+    return module, import_seconds, sum(construction)
+
+
+def measure(study_definition):
+    """
+    timings and query plan of one study definition, imported untraced
+    """
+    module, import_seconds, construction_seconds = import_study(study_definition)
+
+    from query_planner import plan_fused_queries, summarise_plan
+    from variable_definitions import hidden_variables
+
+    variables = module.study.covariate_definitions
+    summary = summarise_plan(plan_fused_queries(variables))
+    to_sql = getattr(module.study, "to_sql", None)
+    try:
+        sql_characters = len(to_sql()) if to_sql else None
+    except Exception:
+        # rendering SQL needs a database backend to be configured
+        sql_characters = None
+    return {
+        "import_seconds": round(import_seconds, 4),
+        "construction_seconds": round(construction_seconds, 4),
+        "top_level_variables": len(variables) - len(hidden_variables(variables)),
+        "variables": len(variables),
+        "event_queries": sum(counts["variables"] for counts in summary.values()),
+        "fused_scans": sum(counts["scans"] for counts in summary.values()),
+        "sql_characters": sql_characters,
+    }
+
+
+def measure_memory(study_definition):
+    """
+    peak memory allocated by Python while importing one study definition;
+    tracing slows the import down, so this is a separate run from measure()
+    """
+    import tracemalloc
+
+    import cohortextractor  # noqa: F401 (not counted, as for the timings)
+
+    tracemalloc.start()
+    __import__(study_definition)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"peak_memory_mb": round(peak / 2**20, 2)}
+
+
+def measure_in_subprocess(study_definition):
+    measurements = {}
+    for mode in ("--measure", "--measure-memory"):
+        result = run_python([os.path.abspath(__file__), mode, study_definition])
+        measurements.update(json.loads(result.stdout.splitlines()[-1]))
+    return measurements
+
+
+def best_of(runs):
+    """
+    one measurement from repeated runs: the fastest times, the other values
+    from the first run
+    """
+    best = dict(runs[0])
+    for key in ("import_seconds", "construction_seconds"):
+        best[key] = min(run[key] for run in runs)
+    return best
+
+
+def git_commit():
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=analysis_directory, capture_output=True, text=True
+    )
+    return result.stdout.strip() or None
+
+
+def run_benchmarks(modules, history, repeat=1):
+    results = {}
+    for study_definition in modules:
+        results[study_definition] = best_of([measure_in_subprocess(study_definition) for _ in range(repeat)])
+        print(f"{study_definition:30} {format_measurements(results[study_definition])}")
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(history) or ".", exist_ok=True)
+    with open(history, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return record
+
+
+def format_measurements(measurements):
+    return (
+        f"import {measurements['import_seconds']:.3f}s "
+        f"(construction {measurements['construction_seconds']:.3f}s), "
+        f"peak {measurements['peak_memory_mb']:.1f}MB, "
+        f"{measurements['variables']} variables, "
+        f"{measurements['event_queries']} event queries in {measurements['fused_scans']} scans, "
+        f"SQL {measurements['sql_characters'] if measurements['sql_characters'] is not None else '-'} characters"
+    )
+
+
+def read_history(history):
+    with open(history) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(history):
+    """
+    print the changes between the last two runs in the history, flagging
+    relative increases above each measurement's tolerance
+    """
+    records = read_history(history)
+    if len(records) < 2:
+        print(f"Nothing to compare: {len(records)} run(s) in {history}")
+        return 0
+    previous, latest = records[-2:]
+    print(f"{previous['commit']} ({previous['timestamp']}) -> {latest['commit']} ({latest['timestamp']})")
+    notable = 0
+    for study_definition, measurements in latest["results"].items():
+        before = previous["results"].get(study_definition)
+        if before is None:
+            continue
+        for key, tolerance in compared_measurements.items():
+            old, new = before.get(key), measurements.get(key)
+            if old is None or new is None or old == new:
+                continue
+            change = (new - old) / old if old else float("inf")
+            flag = " <--" if change > tolerance else ""
+            notable += bool(flag)
+            print(f"  {study_definition:30} {key:22} {old:>10} -> {new:>10} ({change:+.1%}){flag}")
+    return 1 if notable else 0
+
+
+def main(arguments):
+    history = default_history
+    if "--history" in arguments:
+        position = arguments.index("--history")
+        history = arguments[position + 1]
+        del arguments[position : position + 2]
+    repeat = 1
+    if "--repeat" in arguments:
+        position = arguments.index("--repeat")
+        repeat = int(arguments[position + 1])
+        del arguments[position : position + 2]
+    if "--compare" in arguments:
+        return compare(history)
+    run_benchmarks(arguments or study_definitions, history, repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        print(json.dumps(measure(sys.argv[2])))
+    elif sys.argv[1:2] == ["--measure-memory"]:
+        print(json.dumps(measure_memory(sys.argv[2])))
+    else:
+        sys.exit(main(sys.argv[1:]))
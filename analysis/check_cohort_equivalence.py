@@ -0,0 +1,136 @@
+# Equivalence check of the local engines
+#
+# Extracts each study definition from an event store with local_engine.py
+# and, together, with multi_cohort_engine.py, and checks that the
+# decompressed cohort files are identical, and identical to a reference
+# extraction if one is given (for example the local/ directory of a run on
+# the commit before a change). With a synthetic store (see
+# synthetic_store.py), run from the project root:
+#   python analysis/synthetic_store.py local_store
+#   python analysis/check_cohort_equivalence.py local_store <output directory> [<study definition> ...] [--reference <directory>]
+# The engines run in <output directory>/project, whose output/ links the
+# store's index dates in place of output/index_dates.csv.gz, and the files
+# the study definitions read from this project's output/ and codelists/.
+# Cohorts are written to <output directory>/local and <output directory>/multi.
+# The exit status is 1 if any cohort differs.
+
+import csv
+import gzip
+import os
+import sys
+
+from import_budget import analysis_directory, run_python
+from synthetic_store import index_dates_file
+
+study_definitions = [
+    "study_definition_prelim",
+    "study_definition_vax",
+    "study_definition_prevax",
+    "study_definition_unvax",
+    "study_definition_prevax_extf",
+    "study_definition_unvax_extf",
+]
+
+# Files of output/ that the study definitions read
+output_files = ["study_dates.json", "vax_jcvi_groups.csv.gz", "vax_eligible_dates.csv.gz"]
+
+# The prelim cohort defines the index dates of the others, so is not
+# extracted together with them
+not_multi_cohort = {"study_definition_prelim"}
+
+
+def cohort_file(directory, study_definition):
+    return os.path.join(directory, f"input_{study_definition.replace('study_definition_', '')}.csv.gz")
+
+
+def link(path, link_path):
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.abspath(path), link_path)
+
+
+def project_directory(store_directory, output_directory):
+    """
+    make the directory the engines run in, with the store's index dates as
+    output/index_dates.csv.gz, returning its path
+    """
+    project = os.path.join(output_directory, "project")
+    os.makedirs(os.path.join(project, "output"), exist_ok=True)
+    link("codelists", os.path.join(project, "codelists"))
+    for name in output_files:
+        link(os.path.join("output", name), os.path.join(project, "output", name))
+    link(os.path.join(store_directory, index_dates_file), os.path.join(project, "output", "index_dates.csv.gz"))
+    return project
+
+
+def extract(store_directory, output_directory, modules):
+    """
+    extract the cohorts with each engine, returning the local and
+    multi-cohort output directories
+    """
+    project = project_directory(store_directory, output_directory)
+    store_directory = os.path.abspath(store_directory)
+    local_directory = os.path.abspath(os.path.join(output_directory, "local"))
+    multi_directory = os.path.abspath(os.path.join(output_directory, "multi"))
+    os.makedirs(local_directory, exist_ok=True)
+    os.makedirs(multi_directory, exist_ok=True)
+    for study_definition in modules:
+        output = cohort_file(local_directory, study_definition)
+        run_python(
+            [os.path.join(analysis_directory, "local_engine.py"), study_definition, store_directory, output],
+            cwd=project,
+        )
+    joint = [study_definition for study_definition in modules if study_definition not in not_multi_cohort]
+    if joint:
+        run_python(
+            [os.path.join(analysis_directory, "multi_cohort_engine.py"), store_directory, multi_directory, *joint],
+            cwd=project,
+        )
+    return local_directory, multi_directory
+
+
+def first_difference(path, other_path):
+    """
+    None if two cohort files hold the same text, else a description of the
+    first row (or header) in which they differ
+    """
+    with gzip.open(path, "rt", newline="") as f, gzip.open(other_path, "rt", newline="") as g:
+        if f.read() == g.read():
+            return None
+    with gzip.open(path, "rt", newline="") as f, gzip.open(other_path, "rt", newline="") as g:
+        rows, other_rows = csv.reader(f), csv.reader(g)
+        header, other_header = next(rows, []), next(other_rows, [])
+        if header != other_header:
+            return f"columns differ: {sorted(set(header) ^ set(other_header)) or 'in order'}"
+        for number, (row, other_row) in enumerate(zip(rows, other_rows), start=2):
+            if row != other_row:
+                columns = [name for name, value, other in zip(header, row, other_row) if value != other]
+                return f"row {number} differs in {', '.join(columns)}"
+        return "numbers of rows differ"
+
+
+def main(store_directory, output_directory, *modules, reference=None):
+    local_directory, multi_directory = extract(store_directory, output_directory, modules or study_definitions)
+    different = False
+    for study_definition in modules or study_definitions:
+        local = cohort_file(local_directory, study_definition)
+        comparisons = []
+        if study_definition not in not_multi_cohort:
+            comparisons.append(("multi-cohort", cohort_file(multi_directory, study_definition)))
+        if reference:
+            comparisons.append(("reference", cohort_file(reference, study_definition)))
+        for name, other in comparisons:
+            difference = first_difference(local, other)
+            different |= difference is not None
+            print(f"{study_definition:30} {name:13} {'same' if difference is None else 'DIFFERENT: ' + difference}")
+    return 1 if different else 0
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    reference = None
+    if "--reference" in arguments:
+        position = arguments.index("--reference")
+        reference = arguments[position + 1]
+        del arguments[position : position + 2]
+    sys.exit(main(*arguments, reference=reference))
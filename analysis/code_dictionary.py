@@ -0,0 +1,169 @@
+# Integer-interned codes for the project's codelists
+#
+# Every code seen in a codelist is given a dense integer id within its coding
+# system (snomed, ctv3, icd10, ...). A codelist is then represented as a sorted
+# array of ids, so membership tests, unions and intersections are vectorised
+# array operations rather than comparisons between lists of strings.
+
+import numpy as np
+
+from codelists import codelist_definitions, load_codelist
+
+code_id_dtype = np.int32
+
+# Value returned by CodeDictionary.lookup() for codes not in any codelist
+unknown_code_id = -1
+
+
+class CodeDictionary:
+    """
+    mapping between the code strings of one coding system and dense integer ids
+    """
+
+    def __init__(self, system):
+        self.system = system
+        self.codes = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def intern(self, code):
+        """
+        return the id for code, assigning the next free id if it is new
+        """
+        code_id = self.ids.get(code)
+        if code_id is None:
+            code_id = len(self.codes)
+            self.ids[code] = code_id
+            self.codes.append(code)
+        return code_id
+
+    def encode(self, codes):
+        """
+        intern codes and return them as a sorted array of unique ids
+        """
+        return np.unique(
+            np.fromiter((self.intern(code) for code in codes), dtype=code_id_dtype)
+        )
+
+    def lookup(self, codes):
+        """
+        map an array of (e.g. event) codes to ids without interning them;
+        codes that are not in the dictionary map to unknown_code_id
+        """
+        codes = np.asarray(codes)
+        if codes.size == 0:
+            return np.empty(0, dtype=code_id_dtype)
+        # look each distinct code up once, then broadcast back
+        distinct, inverse = np.unique(codes, return_inverse=True)
+        distinct_ids = np.fromiter(
+            (self.ids.get(code, unknown_code_id) for code in distinct.tolist()),
+            dtype=code_id_dtype,
+            count=len(distinct),
+        )
+        return distinct_ids[inverse.reshape(codes.shape)]
+
+    def decode(self, ids):
+        """
+        map an array of ids back to their code strings
+        """
+        return [self.codes[code_id] for code_id in np.asarray(ids).tolist()]
+
+
+code_dictionaries = {}
+interned_codelists = {}
+interned_codelist_categories = {}
+
+
+def code_dictionary(system):
+    """
+    return the (shared) code dictionary for a coding system
+    """
+    if system not in code_dictionaries:
+        code_dictionaries[system] = CodeDictionary(system)
+    return code_dictionaries[system]
+
+
+def interned_codelist(name):
+    """
+    return the named codelist as a sorted array of unique code ids in the
+    dictionary of its coding system
+    """
+    if name not in interned_codelists:
+        loaded = load_codelist(name)
+        dictionary = code_dictionary(loaded.system)
+        if loaded.has_categories:
+            codes = [code for code, _ in loaded]
+            ids = dictionary.encode(codes)
+            # categories aligned with the sorted ids; where a code appears
+            # more than once the first category wins, as in the codelist CSV
+            category_of = {}
+            for code, category in loaded:
+                category_of.setdefault(dictionary.ids[code], category)
+            interned_codelist_categories[name] = np.array(
+                [category_of[code_id] for code_id in ids.tolist()], dtype=object
+            )
+        else:
+            ids = dictionary.encode(loaded)
+        interned_codelists[name] = ids
+    return interned_codelists[name]
+
+
+def interned_categories(name):
+    """
+    return the categories of a categorised codelist, aligned with
+    interned_codelist(name), or None if it has no category column
+    """
+    interned_codelist(name)
+    return interned_codelist_categories.get(name)
+
+
+def build_code_dictionaries():
+    """
+    intern every registered codelist, assigning ids in sorted code order so
+    that they are the same in every process (once all are interned, further
+    calls do nothing)
+    """
+    if all(name in interned_codelists for name in codelist_definitions):
+        return code_dictionaries
+    codes_by_system = {}
+    for name in codelist_definitions:
+        loaded = load_codelist(name)
+        codes = (code for code, _ in loaded) if loaded.has_categories else loaded
+        codes_by_system.setdefault(loaded.system, set()).update(codes)
+    for system, codes in codes_by_system.items():
+        dictionary = code_dictionary(system)
+        for code in sorted(codes):
+            dictionary.intern(code)
+    for name in codelist_definitions:
+        interned_codelist(name)
+    return code_dictionaries
+
+
+def codes_in(code_ids, codelist_ids):
+    """
+    boolean mask of which code ids are members of a (sorted) interned codelist
+    """
+    code_ids = np.asarray(code_ids)
+    if len(codelist_ids) == 0:
+        return np.zeros(code_ids.shape, dtype=bool)
+    positions = np.searchsorted(codelist_ids, code_ids)
+    positions[positions == len(codelist_ids)] = 0
+    return codelist_ids[positions] == code_ids
+
+
+def union(*codelist_ids):
+    """
+    union of interned codelists
+    """
+    return np.unique(np.concatenate(codelist_ids))
+
+
+def intersection(first, *rest):
+    """
+    intersection of interned codelists
+    """
+    for other in rest:
+        first = np.intersect1d(first, other, assume_unique=True)
+    return first
@@ -1,35 +1,187 @@
-from cohortextractor import codelist_from_csv, combine_codelists, codelist
+from cohortextractor import codelist_from_csv, codelist
+from cohortextractor import combine_codelists as combine_codelists_uncached
+
+import hashlib
+import os
+import pickle
+
+# Codelist registry -----------------------------------------------------------
+# Codelists are registered by name below and are only parsed from their CSV
+# the first time they are accessed as an attribute of this module, e.g.
+# `from codelists import covid_codes`. Importing names explicitly (rather than
+# `from codelists import *`, which still works but loads everything) means
+# each study definition only pays for the codelists it actually uses.
+
+codelist_definitions = {}
+loaded_codelists = {}
+
+# Unions built with combine_codelists() are memoized on the identity of their
+# inputs, so the same combination requested twice (e.g. the primary care
+# COVID-19 codes used for both the exposure and the history flag) is the
+# identical object and only needs to be uploaded and matched once
+combined_codelists = {}
+combined_codelist_uses = {}
+
+# Parsed codelists are also stored in a binary cache shared between processes,
+# keyed by the content hash of the source CSV and the arguments used to read
+# it, so an edited CSV is simply a cache miss. Set CODELIST_CACHE_DIR="" to
+# disable the cache.
+codelist_cache_dir = os.environ.get("CODELIST_CACHE_DIR", ".codelist_cache")
+
+
+def lazy_codelist_from_csv(name, filename, system, column="code", category_column=None):
+    """
+    register a codelist to be read with codelist_from_csv() on first access
+    """
+    codelist_definitions[name] = dict(
+        filename=filename,
+        system=system,
+        column=column,
+        category_column=category_column,
+    )
+
+
+def lazy_combine_codelists(name, *codelist_names):
+    """
+    register a codelist to be built with combine_codelists() from the named
+    codelists on first access
+    """
+    codelist_definitions[name] = dict(combine=codelist_names)
+
+
+def cached_codelist_from_csv(filename, system, column="code", category_column=None):
+    """
+    codelist_from_csv() backed by the binary codelist cache
+    """
+    if not codelist_cache_dir:
+        return codelist_from_csv(filename, system=system, column=column, category_column=category_column)
+
+    with open(filename, "rb") as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    key = hashlib.sha256(
+        repr((content_hash, system, column, category_column)).encode()
+    ).hexdigest()
+    cache_path = os.path.join(codelist_cache_dir, f"{key}.pickle")
+
+    try:
+        with open(cache_path, "rb") as f:
+            cached_system, codes = pickle.load(f)
+        return codelist(codes, cached_system)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    parsed = codelist_from_csv(filename, system=system, column=column, category_column=category_column)
+
+    # write to a temporary file first so concurrent actions never read a
+    # partially written entry; an unwritable cache is not an error
+    try:
+        os.makedirs(codelist_cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((parsed.system, list(parsed)), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+    return parsed
+
+
+def combine_codelists(*codelists):
+    """
+    combine_codelists() that returns the identical object for identical inputs
+    """
+    key = tuple(id(component) for component in codelists)
+    if key not in combined_codelists:
+        # keep the inputs alive so that their ids cannot be reused
+        combined_codelists[key] = (codelists, combine_codelists_uncached(*codelists))
+        combined_codelist_uses[key] = 0
+    combined_codelist_uses[key] += 1
+    return combined_codelists[key][1]
+
+
+def report_shared_codelists():
+    """
+    list the combined codelists requested more than once, as a tuple of
+    component names (where known) with the number of requests
+    """
+    names = {id(loaded): name for name, loaded in loaded_codelists.items()}
+    return [
+        (
+            tuple(names.get(id(component), "<unnamed>") for component in components),
+            combined_codelist_uses[key],
+        )
+        for key, (components, _) in combined_codelists.items()
+        if combined_codelist_uses[key] > 1
+    ]
+
+
+def load_codelist(name):
+    """
+    return the named codelist, parsing it (and any codelists it combines) the
+    first time it is requested
+    """
+    if name not in loaded_codelists:
+        definition = codelist_definitions[name]
+        if "combine" in definition:
+            loaded = combine_codelists(
+                *[load_codelist(component) for component in definition["combine"]]
+            )
+        else:
+            loaded = cached_codelist_from_csv(**definition)
+        loaded_codelists[name] = loaded
+        globals()[name] = loaded
+    return loaded_codelists[name]
+
+
+def report_loaded_codelists():
+    """
+    list the names of the codelists parsed so far by this process
+    """
+    return list(loaded_codelists)
+
+
+def __getattr__(name):
+    if name in codelist_definitions:
+        return load_codelist(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Covid
-covid_codes = codelist_from_csv(
+lazy_codelist_from_csv(
+    "covid_codes",
     "codelists/user-RochelleKnight-confirmed-hospitalised-covid-19.csv",
     system="icd10",
     column="code",
 )
-covid_primary_care_positive_test = codelist_from_csv(
+lazy_codelist_from_csv(
+    "covid_primary_care_positive_test",
     "codelists/opensafely-covid-identification-in-primary-care-probable-covid-positive-test.csv",
     system="ctv3",
     column="CTV3ID",
 )
-covid_primary_care_code = codelist_from_csv(
+lazy_codelist_from_csv(
+    "covid_primary_care_code",
     "codelists/opensafely-covid-identification-in-primary-care-probable-covid-clinical-code.csv",
     system="ctv3",
     column="CTV3ID",
 )
-covid_primary_care_sequalae = codelist_from_csv(
+lazy_codelist_from_csv(
+    "covid_primary_care_sequalae",
     "codelists/opensafely-covid-identification-in-primary-care-probable-covid-sequelae.csv",
     system="ctv3",
     column="CTV3ID",
 )
 
 # Ethnicity
-opensafely_ethnicity_codes_6 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "opensafely_ethnicity_codes_6",
     "codelists/opensafely-ethnicity.csv",
     system="ctv3",
     column="Code",
     category_column="Grouping_6",
 )
-primis_covid19_vacc_update_ethnicity = codelist_from_csv(
+lazy_codelist_from_csv(
+    "primis_covid19_vacc_update_ethnicity",
     "codelists/primis-covid19-vacc-uptake-eth2001.csv",
     system="snomed",
     column="code",
@@ -37,13 +189,15 @@ primis_covid19_vacc_update_ethnicity = codelist_from_csv(
 )
 
 # Smoking
-smoking_clear = codelist_from_csv(
+lazy_codelist_from_csv(
+    "smoking_clear",
     "codelists/opensafely-smoking-clear.csv",
     system="ctv3",
     column="CTV3Code",
     category_column="Category",
 )
-smoking_unclear = codelist_from_csv(
+lazy_codelist_from_csv(
+    "smoking_unclear",
     "codelists/opensafely-smoking-unclear.csv",
     system="ctv3",
     column="CTV3Code",
@@ -51,205 +205,238 @@ smoking_unclear = codelist_from_csv(
 )
 
 # AMI
-ami_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ami_snomed_clinical",
     "codelists/user-elsie_horne-ami_snomed.csv",
     system="snomed",
     column="code",
 )
-ami_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ami_icd10",
     "codelists/user-RochelleKnight-ami_icd10.csv",
     system="icd10",
     column="code",
 )
-ami_prior_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ami_prior_icd10",
     "codelists/user-elsie_horne-ami_prior_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Cancer
-cancer_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "cancer_snomed_clinical",
     "codelists/user-elsie_horne-cancer_snomed.csv",
     system="snomed",
     column="code",
 )
-cancer_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "cancer_icd10",
     "codelists/user-elsie_horne-cancer_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # COPD
-copd_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "copd_snomed_clinical",
     "codelists/user-elsie_horne-copd_snomed.csv",
     system="snomed",
     column="code",
 )
-copd_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "copd_icd10",
     "codelists/user-elsie_horne-copd_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Dementia
-dementia_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "dementia_snomed_clinical",
     "codelists/user-elsie_horne-dementia_snomed.csv",
     system="snomed",
     column="code",
 )
-dementia_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "dementia_icd10",
     "codelists/user-elsie_horne-dementia_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Dementia vascular 
-dementia_vascular_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "dementia_vascular_snomed_clinical",
     "codelists/user-elsie_horne-dementia_vascular_snomed.csv",
     system="snomed",
     column="code",
 )
 
-dementia_vascular_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "dementia_vascular_icd10",
     "codelists/user-elsie_horne-dementia_vascular_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Liver disease
-liver_disease_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "liver_disease_snomed_clinical",
     "codelists/user-elsie_horne-liver_disease_snomed.csv",
     system="snomed",
     column="code",
 )
-liver_disease_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "liver_disease_icd10",
     "codelists/user-elsie_horne-liver_disease_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Hypertension
-hypertension_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "hypertension_icd10",
     "codelists/user-elsie_horne-hypertension_icd10.csv",
     system="icd10",
     column="code",
 )
-hypertension_drugs_dmd = codelist_from_csv(
+lazy_codelist_from_csv(
+    "hypertension_drugs_dmd",
     "codelists/user-elsie_horne-hypertension_drugs_dmd.csv",
     system="snomed",
     column="dmd_id",
 )
-hypertension_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "hypertension_snomed_clinical",
     "codelists/nhsd-primary-care-domain-refsets-hyp_cod.csv",
     system="snomed",
     column="code",
 )
 
 # Prostate
-prostate_cancer_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "prostate_cancer_icd10",
     "codelists/user-RochelleKnight-prostate_cancer_icd10.csv",
     system="icd10",
     column="code",
 )
-prostate_cancer_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "prostate_cancer_snomed_clinical",
     "codelists/user-RochelleKnight-prostate_cancer_snomed.csv",
     system="snomed",
     column="code",
 )
 
 # Pregnancy
-pregnancy_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "pregnancy_snomed_clinical",
     "codelists/user-RochelleKnight-pregnancy_and_birth_snomed.csv",
     system="snomed",
     column="code",
 )
 
 # Stroke 
-stroke_isch_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "stroke_isch_icd10",
     "codelists/user-RochelleKnight-stroke_isch_icd10.csv",
     system="icd10",
     column="code",
 )
-stroke_isch_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "stroke_isch_snomed_clinical",
     "codelists/user-elsie_horne-stroke_isch_snomed.csv",
     system="snomed",
     column="code",
 )
 
 # BMI
-bmi_obesity_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "bmi_obesity_snomed_clinical",
     "codelists/user-elsie_horne-bmi_obesity_snomed.csv",
     system="snomed",
     column="code",
 )
-bmi_obesity_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "bmi_obesity_icd10",
     "codelists/user-elsie_horne-bmi_obesity_icd10.csv",
     system="icd10",
     column="code",
 )
-bmi_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "bmi_primis",
     "codelists/primis-covid19-vacc-uptake-bmi.csv",
     system="snomed",
     column="code",
 )
 
 # Carer codes
-carer_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "carer_primis",
     "codelists/primis-covid19-vacc-uptake-carer.csv",
     system="snomed",
     column="code",
 )
 
 # No longer a carer codes
-notcarer_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "notcarer_primis",
     "codelists/primis-covid19-vacc-uptake-notcarer.csv",
     system="snomed",
     column="code",
 )
 
 # Wider Learning Disability
-learndis_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "learndis_primis",
     "codelists/primis-covid19-vacc-uptake-learndis.csv",
     system="snomed",
     column="code",
 )
 
 # Employed by Care Home codes
-carehome_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "carehome_primis",
     "codelists/primis-covid19-vacc-uptake-carehome.csv",
     system="snomed",
     column="code",
 )
 
 # Employed by nursing home codes
-nursehome_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "nursehome_primis",
     "codelists/primis-covid19-vacc-uptake-nursehome.csv",
     system="snomed",
     column="code",
 )
 
 # Employed by domiciliary care provider codes
-domcare_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "domcare_primis",
     "codelists/primis-covid19-vacc-uptake-domcare.csv",
     system="snomed",
     column="code",
 )
 
 # Patients in long-stay nursing and residential care
-longres_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "longres_primis",
     "codelists/primis-covid19-vacc-uptake-longres.csv",
     system="snomed",
     column="code",
 )
 # High Risk from COVID-19 code
-shield_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "shield_primis",
     "codelists/primis-covid19-vacc-uptake-shield.csv",
     system="snomed",
     column="code",
 )
 
 # Lower Risk from COVID-19 codes
-nonshield_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "nonshield_primis",
     "codelists/primis-covid19-vacc-uptake-nonshield.csv",
     system="snomed",
     column="code",
@@ -257,187 +444,215 @@ nonshield_primis = codelist_from_csv(
 
 #For JCVI groups
 # Pregnancy codes 
-preg_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "preg_primis",
     "codelists/primis-covid19-vacc-uptake-preg.csv",
     system="snomed",
     column="code",
 )
 
 # Pregnancy or Delivery codes
-pregdel_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "pregdel_primis",
     "codelists/primis-covid19-vacc-uptake-pregdel.csv",
     system="snomed",
     column="code",
 )
 
 # High Risk from COVID-19 code
-shield_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "shield_primis",
     "codelists/primis-covid19-vacc-uptake-shield.csv",
     system="snomed",
     column="code",
 )
 
 # Lower Risk from COVID-19 codes
-nonshield_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "nonshield_primis",
     "codelists/primis-covid19-vacc-uptake-nonshield.csv",
     system="snomed",
     column="code",
 )
 
 # Asthma Diagnosis code
-ast_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ast_primis",
     "codelists/primis-covid19-vacc-uptake-ast.csv",
     system="snomed",
     column="code",
 )
 
 # All BMI coded terms
-bmi_stage_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "bmi_stage_primis",
     "codelists/primis-covid19-vacc-uptake-bmi_stage.csv",
     system="snomed",
     column="code",
 )
 # Severe Obesity code recorded
-sev_obesity_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "sev_obesity_primis",
     "codelists/primis-covid19-vacc-uptake-sev_obesity.csv",
     system="snomed",
     column="code",
 )
 # Asthma Diagnosis code
-ast_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ast_primis",
     "codelists/primis-covid19-vacc-uptake-ast.csv",
     system="snomed",
     column="code",
 )
 
 # Asthma Admission codes
-astadm_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "astadm_primis",
     "codelists/primis-covid19-vacc-uptake-astadm.csv",
     system="snomed",
     column="code",
 )
 
 # Asthma systemic steroid prescription codes
-astrx_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "astrx_primis",
     "codelists/primis-covid19-vacc-uptake-astrx.csv",
     system="snomed",
     column="code",
 )
 # Chronic Respiratory Disease
-resp_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "resp_primis",
     "codelists/primis-covid19-vacc-uptake-resp_cov.csv",
     system="snomed",
     column="code",
 )
 # Chronic Neurological Disease including Significant Learning Disorder
-cns_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "cns_primis",
     "codelists/primis-covid19-vacc-uptake-cns_cov.csv",
     system="snomed",
     column="code",
 )
 
 # Chronic heart disease codes
-chd_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "chd_primis",
     "codelists/primis-covid19-vacc-uptake-chd_cov.csv",
     system="snomed",
     column="code",
 )
 
 # Asplenia or Dysfunction of the Spleen codes
-spln_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "spln_primis",
     "codelists/primis-covid19-vacc-uptake-spln_cov.csv",
     system="snomed",
     column="code",
 )
 # Diabetes diagnosis codes
-diab_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diab_primis",
     "codelists/primis-covid19-vacc-uptake-diab.csv",
     system="snomed",
     column="code",
 )
 # Diabetes resolved codes
-dmres_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "dmres_primis",
     "codelists/primis-covid19-vacc-uptake-dmres.csv",
     system="snomed",
     column="code",
 )
 # Severe Mental Illness codes
-sev_mental_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "sev_mental_primis",
     "codelists/primis-covid19-vacc-uptake-sev_mental.csv",
     system="snomed",
     column="code",
 )
 
 # Remission codes relating to Severe Mental Illness
-smhres_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "smhres_primis",
     "codelists/primis-covid19-vacc-uptake-smhres.csv",
     system="snomed",
     column="code",
 )
 
 # Chronic heart disease codes
-chd_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "chd_primis",
     "codelists/primis-covid19-vacc-uptake-chd_cov.csv",
     system="snomed",
     column="code",
 )
 
 # Chronic Kidney disease
-ckd_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ckd_snomed_clinical",
     "codelists/user-elsie_horne-ckd_snomed.csv",
     system="snomed",
     column="code",
 )
 
-ckd_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ckd_icd10",
     "codelists/user-elsie_horne-ckd_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Chronic kidney disease diagnostic codes
-ckd_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ckd_primis",
     "codelists/primis-covid19-vacc-uptake-ckd_cov.csv",
     system="snomed",
     column="code",
 )
 
 # Chronic kidney disease codes - all stages
-ckd15_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ckd15_primis",
     "codelists/primis-covid19-vacc-uptake-ckd15.csv",
     system="snomed",
     column="code",
 )
 
 # Chronic kidney disease codes-stages 3 - 5
-ckd35_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ckd35_primis",
     "codelists/primis-covid19-vacc-uptake-ckd35.csv",
     system="snomed",
     column="code",
 )
 
 # Chronic Liver disease codes
-cld_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "cld_primis",
     "codelists/primis-covid19-vacc-uptake-cld.csv",
     system="snomed",
     column="code",
 )
 # Immunosuppression diagnosis codes
-immdx_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "immdx_primis",
     "codelists/primis-covid19-vacc-uptake-immdx_cov.csv",
     system="snomed",
     column="code",
 )
 
 # Immunosuppression medication codes
-immrx_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "immrx_primis",
     "codelists/primis-covid19-vacc-uptake-immrx.csv",
     system="snomed",
     column="code",
 )
 
 # to represent household contact of shielding individual
-hhld_imdef_primis = codelist_from_csv(
+lazy_codelist_from_csv(
+    "hhld_imdef_primis",
     "codelists/primis-covid19-vacc-uptake-hhld_imdef.csv",
     system="snomed",
     column="code",
@@ -445,67 +660,78 @@ hhld_imdef_primis = codelist_from_csv(
 
 # Diabetes
 # Type 1 diabetes
-diabetes_type1_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diabetes_type1_snomed_clinical",
     "codelists/user-hjforbes-type-1-diabetes.csv",
     system="ctv3",
     column="code",
 )
 # Type 1 diabetes secondary care
-diabetes_type1_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diabetes_type1_icd10",
     "codelists/opensafely-type-1-diabetes-secondary-care.csv",
     system="icd10",
     column="icd10_code",
 )
 # Type 2 diabetes
-diabetes_type2_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diabetes_type2_snomed_clinical",
     "codelists/user-hjforbes-type-2-diabetes.csv",
     system="ctv3",
     column="code",
 )
 # Type 2 diabetes secondary care
-diabetes_type2_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diabetes_type2_icd10",
     "codelists/user-r_denholm-type-2-diabetes-secondary-care-bristol.csv",
     system="icd10",
     column="code",
 )
 # Non-diagnostic diabetes codes
-diabetes_diagnostic_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diabetes_diagnostic_snomed_clinical",
     "codelists/user-hjforbes-nondiagnostic-diabetes-codes.csv",
     system="ctv3",
     column="code",
 )
 # Other or non-specific diabetes
-diabetes_other_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diabetes_other_snomed_clinical",
     "codelists/user-hjforbes-other-or-nonspecific-diabetes.csv",
     system="ctv3",
     column="code",
 )
 # Gestational diabetes
-diabetes_gestational_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "diabetes_gestational_snomed_clinical",
     "codelists/user-hjforbes-gestational-diabetes.csv",
     system="ctv3",
     column="code",
 )
 # Insulin medication 
-insulin_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "insulin_snomed_clinical",
      "codelists/opensafely-insulin-medication.csv",
      system="snomed",
      column="id",
 )
 # Antidiabetic drugs
-antidiabetic_drugs_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "antidiabetic_drugs_snomed_clinical",
      "codelists/opensafely-antidiabetic-drugs.csv",
      system="snomed",
      column="id",
 )
 # Antidiabetic drugs - non metformin
-non_metformin_dmd = codelist_from_csv(
+lazy_codelist_from_csv(
+    "non_metformin_dmd",
     "codelists/user-r_denholm-non-metformin-antidiabetic-drugs_bristol.csv", 
     system="snomed", 
     column="id",
 )
 # Prediabetes
-prediabetes_snomed = codelist_from_csv(
+lazy_codelist_from_csv(
+    "prediabetes_snomed",
     "codelists/opensafely-prediabetes-snomed.csv",
     system="snomed",
     column="code",
@@ -513,17 +739,20 @@ prediabetes_snomed = codelist_from_csv(
 
 ##Quality assurance codes 
 
-prostate_cancer_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "prostate_cancer_snomed_clinical",
     "codelists/user-RochelleKnight-prostate_cancer_snomed.csv",
     system="snomed",
     column="code",
 )
-prostate_cancer_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "prostate_cancer_icd10",
     "codelists/user-RochelleKnight-prostate_cancer_icd10.csv",
     system="icd10",
     column="code",
 )
-pregnancy_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "pregnancy_snomed_clinical",
     "codelists/user-RochelleKnight-pregnancy_and_birth_snomed.csv",
     system="snomed",
     column="code",
@@ -536,56 +765,64 @@ pregnancy_snomed_clinical = codelist_from_csv(
 # MENTAL HEALTH RELATED CODE LISTS
 
 # Depression 
-depression_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "depression_snomed_clinical",
     "codelists/user-hjforbes-depression-symptoms-and-diagnoses.csv",
     system="snomed",
     column="code",
 )
 
 # Anxiety - general
-anxiety_general_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "anxiety_general_snomed_clinical",
     "codelists/user-hjforbes-anxiety-symptoms-and-diagnoses.csv",
     system="snomed",
     column="code",
 )
 
 # Anxiety - obsessive compulsive disorder
-anxiety_ocd_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "anxiety_ocd_snomed_clinical",
     "codelists/user-hjforbes-obsessive-compulsive-disorder-ocd.csv",
     system="snomed",
     column="code",
 )
 
 # Anxiety - post traumatic stress disorder
-anxiety_ptsd_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "anxiety_ptsd_snomed_clinical",
     "codelists/user-hjforbes-post-traumatic-stress-disorder.csv",
     system="snomed",
     column="code",
 )
 
 # Eating disorders
-eating_disorders_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "eating_disorders_snomed_clinical",
     "codelists/user-hjforbes-diagnoses-eating-disorder.csv",
     system="snomed",
     column="code",
 )
 
 # Serious mental illness
-serious_mental_illness_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "serious_mental_illness_snomed_clinical",
     "codelists/user-hjforbes-severe-mental-illness.csv",
     system="snomed",
     column="code",
 )
 
 # Self harm - aged >= 10 years
-self_harm_10plus_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "self_harm_10plus_snomed_clinical",
     "codelists/user-hjforbes-intentional-self-harm-aged10-years.csv",
     system="snomed",
     column="code",
 )
 
 # Self harm - aged >= 15 years
-self_harm_15plus_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "self_harm_15plus_snomed_clinical",
     "codelists/user-hjforbes-undetermined-intent-self-harm-aged15-years.csv",
     system="snomed",
     column="code",
@@ -593,118 +830,135 @@ self_harm_15plus_snomed_clinical = codelist_from_csv(
 
 # Self harm undetermined intent - combined
 
-self_harm_15_10_combined_snomed = combine_codelists(
-    self_harm_10plus_snomed_clinical,
-    self_harm_15plus_snomed_clinical
+lazy_combine_codelists(
+    "self_harm_15_10_combined_snomed",
+    "self_harm_10plus_snomed_clinical",
+    "self_harm_15plus_snomed_clinical"
 )
 
 # OCD ICD10
-ocd_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ocd_icd10",
     "codelists/user-kurttaylor-ocd_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Suicide
-suicide_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "suicide_icd10",
     "codelists/user-hjforbes-suicide-icd-10.csv",
     system="icd10",
     column="code",
 )
 
 # Addiction
-addiction_snomed_clinical = codelist_from_csv(
+lazy_codelist_from_csv(
+    "addiction_snomed_clinical",
     "codelists/user-hjforbes-opioid-dependency-clinical-diagnosis.csv",
     system="snomed",
     column="code",
 )
 
 # Opioid misuse ICD10
-opioid_misuse_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "opioid_misuse_icd10",
     "codelists/user-kurttaylor-opioid_misuse_icd10.csv",
     system = "icd10", 
     column = "code",
 )
 
 # Alcohol misuse ICD10
-alcohol_misuse_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "alcohol_misuse_icd10",
     "codelists/user-kurttaylor-alcohol_misuse_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Anxiety ICD10
-anxiety_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "anxiety_icd10",
     "codelists/user-kurttaylor-anxiety_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Bipolar and other mood disorders ICD10
-bipolar_other_mood_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "bipolar_other_mood_icd10",
     "codelists/user-kurttaylor-bipolar_and_mood_disorders_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Depression ICD10
-depression_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "depression_icd10",
     "codelists/user-kurttaylor-depression_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Drug misuse ICD10
-drug_misuse_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "drug_misuse_icd10",
     "codelists/user-kurttaylor-drug_misuse_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Other mental health ICD10
-mental_health_other_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "mental_health_other_icd10",
     "codelists/user-kurttaylor-other_mental_health_conditions_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Mixed depression and anxiety ICD10
-mixed_depression_anxiety_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "mixed_depression_anxiety_icd10",
     "codelists/user-kurttaylor-mixed_depression_and_anxiety_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Other Psychotic disorders ICD10
-psychotic_disorders_other_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "psychotic_disorders_other_icd10",
     "codelists/user-kurttaylor-other-psychotic_disorders_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # PTSD ICD10
-ptsd_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "ptsd_icd10",
     "codelists/user-kurttaylor-ptsd_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Schizophrenia ICD10
-schizophrenia_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "schizophrenia_icd10",
     "codelists/user-kurttaylor-schizophrenia_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Self harm intentional 10 years ICD10
-self_harm_intent_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "self_harm_intent_icd10",
     "codelists/user-kurttaylor-self_harm_intentional_10_years_icd10.csv",
     system="icd10",
     column="code",
 )
 
 # Self harm undetermined intent 15 years 
-self_harm_undet_intent_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "self_harm_undet_intent_icd10",
     "codelists/user-kurttaylor-self_harm_undetermined_intent_15_years_icd10.csv",
     system="icd10",
     column="code",
@@ -712,13 +966,15 @@ self_harm_undet_intent_icd10 = codelist_from_csv(
 
 # Self harm undetermined intent 15 years - combined
 
-self_harm_15_10_combined_icd = combine_codelists(
-    self_harm_intent_icd10,
-    self_harm_undet_intent_icd10
+lazy_combine_codelists(
+    "self_harm_15_10_combined_icd",
+    "self_harm_intent_icd10",
+    "self_harm_undet_intent_icd10"
 )
 
 # Eating Disorder ICD10
-eating_disorder_icd10 = codelist_from_csv(
+lazy_codelist_from_csv(
+    "eating_disorder_icd10",
     "codelists/user-kurttaylor-eating_disorder_icd10.csv",
     system="icd10",
     column="code",
@@ -726,38 +982,50 @@ eating_disorder_icd10 = codelist_from_csv(
 
 # Combined serious mental illness HES
 
-serious_mental_illness_icd10 = combine_codelists(
-    bipolar_other_mood_icd10,
-    psychotic_disorders_other_icd10,
-    schizophrenia_icd10
+lazy_combine_codelists(
+    "serious_mental_illness_icd10",
+    "bipolar_other_mood_icd10",
+    "psychotic_disorders_other_icd10",
+    "schizophrenia_icd10"
 )
 
 # Combined anxiety covariate primary care
 
-anxiety_combined_snomed_cov = combine_codelists(
-    anxiety_general_snomed_clinical,
-    anxiety_ocd_snomed_clinical,
-    anxiety_ptsd_snomed_clinical
+lazy_combine_codelists(
+    "anxiety_combined_snomed_cov",
+    "anxiety_general_snomed_clinical",
+    "anxiety_ocd_snomed_clinical",
+    "anxiety_ptsd_snomed_clinical"
 )
 
 # Combined anxiety covariate HES
 
-anxiety_combined_hes_cov = combine_codelists(
-    anxiety_icd10,
-    ocd_icd10,
-    ptsd_icd10
+lazy_combine_codelists(
+    "anxiety_combined_hes_cov",
+    "anxiety_icd10",
+    "ocd_icd10",
+    "ptsd_icd10"
 )
 
 # COCP
-cocp_dmd = codelist_from_csv(
+lazy_codelist_from_csv(
+    "cocp_dmd",
     "codelists/user-elsie_horne-cocp_dmd.csv",
     system="snomed",
     column="dmd_id",
 )
 
 # HRT
-hrt_dmd = codelist_from_csv(
+lazy_codelist_from_csv(
+    "hrt_dmd",
     "codelists/user-elsie_horne-hrt_dmd.csv",
     system="snomed",
     column="dmd_id",
-)
\ No newline at end of file
+)
+
+__all__ = [
+    "codelist_from_csv",
+    "combine_codelists",
+    "codelist",
+    *codelist_definitions,
+]
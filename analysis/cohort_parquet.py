@@ -0,0 +1,154 @@
+# Parquet output for cohort files
+#
+# An alternative to input_<cohort>.csv.gz: a Parquet file typed by the
+# cohort schema (see cohort_schema.py), with dates stored as date32, flags
+# as booleans and categories dictionary-encoded, and rows sorted by
+# patient_id and split into row groups by patient_id range. Readers can then
+# load only the columns (and row groups) they need, in parallel, without
+# parsing gzipped text. Needs pyarrow, which is optional.
+#
+# The local engines write Parquet when the output path ends .parquet,
+# building the Arrow arrays from their typed columns (int32 days, numbers
+# and strings) and missing masks rather than from formatted text. A cohort
+# file written by cohortextractor can be converted with its schema:
+#   python analysis/cohort_parquet.py output/input_vax.csv.gz output/input_vax.schema.json output/input_vax.parquet
+
+import csv
+import gzip
+import json
+import sys
+
+import numpy as np
+
+from event_store import days_to_dates, epoch, maximum_date, missing_date
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Rows per row group
+row_group_size = 100_000
+
+# Values of logical columns read as true
+true_values = ["1", "TRUE", "True", "T"]
+
+
+def typed_array(values, column_type):
+    """
+    convert the text values of a column (as written to CSV, '' for missing)
+    to an Arrow array of the column's schema type
+    """
+    text = pa.array(values, type=pa.string())
+    missing = pc.equal(text, "")
+    text = pc.if_else(missing, pa.scalar(None, pa.string()), text)
+    if column_type == "logical":
+        return pc.if_else(pc.is_null(text), None, pc.is_in(text, value_set=pa.array(true_values)))
+    if column_type == "integer":
+        return text.cast(pa.int64())
+    if column_type == "double":
+        return text.cast(pa.float64())
+    if column_type == "date":
+        return text.cast(pa.date32())
+    return text.dictionary_encode()
+
+
+def typed_column(kind, values, column_type, date_format=None):
+    """
+    an Arrow array of the column's schema type from a column as the engine
+    holds it: int32 days for dates (missing_date or maximum_date if
+    missing), numbers, or strings ('' if missing)
+    """
+    if kind == "date" and column_type == "date":
+        date_format = date_format or "YYYY-MM-DD"
+        missing = (values == missing_date) | (values == maximum_date)
+        days = np.where(missing, 0, values)
+        if date_format != "YYYY-MM-DD":
+            # the first day of the month (or year) the written date gives
+            unit = {"YYYY-MM": "M", "YYYY": "Y"}[date_format]
+            days = (epoch + days.astype("timedelta64[D]")).astype(f"datetime64[{unit}]").astype("datetime64[D]") - epoch
+        return pa.array(days.astype(np.int32), type=pa.date32(), mask=missing)
+    if kind == "int" and column_type == "logical":
+        # as the text "1" is read as true
+        return pa.array(values == 1, type=pa.bool_())
+    if kind == "int" and column_type == "integer":
+        return pa.array(values, type=pa.int64())
+    if kind in ("int", "float") and column_type == "double":
+        return pa.array(values, type=pa.float64())
+    if kind == "str":
+        return typed_array(values, column_type)
+    # a column whose kind does not match its schema type goes through text
+    if kind == "date":
+        return typed_array(days_to_dates(values, date_format or "YYYY-MM-DD"), column_type)
+    return typed_array(values.astype(str), column_type)
+
+
+def sorted_table(arrays):
+    """
+    an Arrow table of the arrays, sorted by patient_id
+    """
+    table = pa.table(arrays)
+    return table.sort_by("patient_id") if "patient_id" in arrays else table
+
+
+def parquet_table(columns, types):
+    """
+    an Arrow table of typed columns, {name: (kind, values, date format)},
+    typed by the schema and sorted by patient_id
+    """
+    arrays = {}
+    for name, (kind, values, date_format) in columns.items():
+        column_type = "integer" if name == "patient_id" else types.get(name, "character")
+        arrays[name] = typed_column(kind, values, column_type, date_format)
+    return sorted_table(arrays)
+
+
+def text_table(columns, types):
+    """
+    an Arrow table of text columns, typed by the schema and sorted by
+    patient_id
+    """
+    arrays = {}
+    for name, values in columns.items():
+        column_type = "integer" if name == "patient_id" else types.get(name, "character")
+        arrays[name] = typed_array(values, column_type)
+    return sorted_table(arrays)
+
+
+def write_table(table, path):
+    """
+    write an Arrow table to Parquet, one row group per row_group_size
+    patients in patient_id order
+    """
+    pq.write_table(table, path, row_group_size=row_group_size)
+
+
+def write_parquet(columns, types, path):
+    """
+    write typed columns, {name: (kind, values, date format)}, to Parquet
+    """
+    if pa is None:
+        raise ImportError("Parquet output needs pyarrow")
+    write_table(parquet_table(columns, types), path)
+
+
+def convert_csv(csv_path, schema_file, parquet_path):
+    """
+    convert a cohort CSV file to Parquet using its schema
+    """
+    with open(schema_file) as f:
+        types = json.load(f)["columns"]
+    opener = gzip.open if csv_path.endswith(".gz") else open
+    with opener(csv_path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        values = list(zip(*reader)) or [()] * len(header)
+    if pa is None:
+        raise ImportError("Parquet output needs pyarrow")
+    write_table(text_table(dict(zip(header, values)), types), parquet_path)
+
+
+if __name__ == "__main__":
+    convert_csv(*sys.argv[1:4])
@@ -0,0 +1,98 @@
+# Typed schema of a cohort file
+#
+# preprocess_data.R used to read the header of input_<cohort>.csv.gz and
+# guess each column's class from its name (_cat, _bin, _num, _date and a
+# hard-coded list). Here the type of each column is derived from the
+# column_type StudyDefinition gives its definition instead, and written as
+# input_<cohort>.schema.json next to the cohort file:
+#   {"study_definition": "study_definition_vax",
+#    "columns": {"patient_id": "integer", "cov_bin_ami": "logical", ...}}
+# with types "logical", "integer", "double", "date" (YYYY-MM-DD) and
+# "character". The local engines write it with each extract; for the cohort
+# files cohortextractor writes, the generate_schema_<cohort> actions of
+# project.yaml run
+#   python analysis/cohort_schema.py <study definition> <schema file>
+
+import importlib
+import json
+import sys
+
+from variable_definitions import hidden_variables
+
+# Types of cohortextractor's column types (the column_type StudyDefinition
+# gives every variable)
+column_types = {"bool": "logical", "int": "integer", "float": "double", "str": "character", "date": "date"}
+
+# Categories of string flags (such as cov_bin_obesity), which are read as
+# logical
+logical_categories = {"TRUE", "FALSE"}
+
+
+def date_format(variables, name):
+    """
+    format of a date variable; an aggregate_of() has that of its first column
+    """
+    query_type, arguments = variables[name]
+    if query_type == "aggregate_of":
+        return date_format(variables, arguments["column_names"][0])
+    return arguments.get("date_format") or "YYYY-MM-DD"
+
+
+def variable_type(variables, name):
+    """
+    type of the values of a variable, from its column_type
+    """
+    query_type, arguments = variables[name]
+    column_type = arguments["column_type"]
+    categories = arguments.get("category_definitions") or arguments.get("categorised_as") or {}
+    if column_type == "str" and categories and {str(category) for category in categories} <= logical_categories:
+        return "logical"
+    if column_type == "date":
+        # partial dates are written as YYYY or YYYY-MM
+        if date_format(variables, name) == "YYYY":
+            return "integer"
+        if date_format(variables, name) == "YYYY-MM":
+            return "character"
+    return column_types[column_type]
+
+
+def cohort_schema(variables, columns=None):
+    """
+    {column: type} of a cohort file, for the given written columns (by
+    default patient_id and every variable but the hidden ones and the
+    population, as cohortextractor writes them)
+    """
+    if columns is None:
+        hidden = hidden_variables(variables)
+        columns = ["patient_id"] + [name for name in variables if name not in hidden and name != "population"]
+    return {
+        column: "integer" if column == "patient_id" else variable_type(variables, column) for column in columns
+    }
+
+
+def write_schema(path, study_definition, variables, columns=None):
+    """
+    write the schema of a cohort file as JSON
+    """
+    schema = {"study_definition": study_definition, "columns": cohort_schema(variables, columns)}
+    with open(path, "w") as f:
+        json.dump(schema, f, indent=2)
+
+
+def schema_path(cohort_path):
+    """
+    path of the schema written next to a cohort file
+    """
+    for extension in (".csv.gz", ".csv", ".parquet"):
+        if cohort_path.endswith(extension):
+            return cohort_path[: -len(extension)] + ".schema.json"
+    return cohort_path + ".schema.json"
+
+
+def main(study_definition, path):
+    study = importlib.import_module(study_definition).study
+    write_schema(path, study_definition, study.covariate_definitions)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
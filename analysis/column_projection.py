@@ -0,0 +1,66 @@
+# Column projection from the active analyses
+#
+# Every cohort extract carries the out_date_<outcome> column of every
+# outcome, with its tmp_out_date_<outcome>_snomed/_hes/_death sources, but
+# make_model_input.R, venn.R and table2.R only read the outcomes of the
+# analyses in lib/active_analyses.rds. This reads the plain-text manifest of
+# that table (lib/active_analyses.csv, written alongside the .rds by
+# active_analyses.R) and works out which outcome columns a cohort can leave
+# out when only some outcomes are being run. Exposures, covariates and the
+# other columns used by the descriptive tables are always kept.
+
+import csv
+
+# Column families that are only needed for the outcomes of active analyses
+projected_prefixes = ("out_date_", "tmp_out_date_")
+
+# Columns of the manifest naming extract columns (';'-separated, "NULL" for none)
+column_fields = ("exposure", "outcome", "strata", "covariate_sex", "covariate_age", "covariate_other")
+
+
+def read_active_analyses(path="lib/active_analyses.csv"):
+    """
+    rows of the active analyses manifest
+    """
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def analysis_columns(analyses, cohort):
+    """
+    names of the columns the active analyses of a cohort use
+    """
+    columns = set()
+    for analysis in analyses:
+        if analysis["cohort"] != cohort:
+            continue
+        for field in column_fields:
+            value = analysis.get(field) or "NULL"
+            if value != "NULL":
+                columns.update(value.split(";"))
+    return columns
+
+
+def outcome_of(name):
+    """
+    the out_date_<outcome> column a projected column belongs to
+    """
+    if name.startswith("tmp_out_date_"):
+        return "out_date_" + name[len("tmp_out_date_"):].rsplit("_", 1)[0]
+    return name
+
+
+def projected_out_columns(variables, analyses, cohort):
+    """
+    names of the written outcome columns (and their tmp_* sources) of a
+    study's covariate_definitions that no active analysis of the cohort
+    uses; nothing is left out of a cohort without active analyses
+    """
+    used = analysis_columns(analyses, cohort)
+    if not used:
+        return set()
+    return {
+        name
+        for name, (_, arguments) in variables.items()
+        if not arguments.get("hidden") and name.startswith(projected_prefixes) and outcome_of(name) not in used
+    }
@@ -7,7 +7,6 @@ from cohortextractor import (
     patients,
     codelist,
     filter_codes_by_category,
-    combine_codelists,
     codelist_from_csv,
 )
 
@@ -16,7 +15,69 @@ from grouping_variables import (
     study_dates,
     days)
 ## Codelists from codelist.py (which pulls them from the codelist folder)
-from codelists import *
+## NB: combine_codelists is the memoized version from codelists.py
+from codelists import (
+    combine_codelists,
+    covid_codes,
+    covid_primary_care_positive_test,
+    covid_primary_care_code,
+    covid_primary_care_sequalae,
+    opensafely_ethnicity_codes_6,
+    primis_covid19_vacc_update_ethnicity,
+    smoking_clear,
+    ami_snomed_clinical,
+    ami_icd10,
+    ami_prior_icd10,
+    cancer_snomed_clinical,
+    cancer_icd10,
+    copd_snomed_clinical,
+    copd_icd10,
+    dementia_snomed_clinical,
+    dementia_icd10,
+    dementia_vascular_snomed_clinical,
+    dementia_vascular_icd10,
+    liver_disease_snomed_clinical,
+    liver_disease_icd10,
+    hypertension_icd10,
+    hypertension_drugs_dmd,
+    hypertension_snomed_clinical,
+    prostate_cancer_icd10,
+    prostate_cancer_snomed_clinical,
+    pregnancy_snomed_clinical,
+    stroke_isch_icd10,
+    stroke_isch_snomed_clinical,
+    bmi_obesity_snomed_clinical,
+    bmi_obesity_icd10,
+    ckd_snomed_clinical,
+    ckd_icd10,
+    diabetes_type1_snomed_clinical,
+    diabetes_type1_icd10,
+    diabetes_type2_snomed_clinical,
+    diabetes_type2_icd10,
+    diabetes_other_snomed_clinical,
+    diabetes_gestational_snomed_clinical,
+    insulin_snomed_clinical,
+    antidiabetic_drugs_snomed_clinical,
+    depression_snomed_clinical,
+    anxiety_general_snomed_clinical,
+    anxiety_ptsd_snomed_clinical,
+    eating_disorders_snomed_clinical,
+    serious_mental_illness_snomed_clinical,
+    self_harm_15_10_combined_snomed,
+    suicide_icd10,
+    addiction_snomed_clinical,
+    opioid_misuse_icd10,
+    anxiety_icd10,
+    depression_icd10,
+    ptsd_icd10,
+    self_harm_15_10_combined_icd,
+    eating_disorder_icd10,
+    serious_mental_illness_icd10,
+    anxiety_combined_snomed_cov,
+    anxiety_combined_hes_cov,
+    cocp_dmd,
+    hrt_dmd,
+)
 
 ## Datetime functions
 from datetime import date
@@ -0,0 +1,145 @@
+# Decision tables for categorised_as() rules
+#
+# vax_cat_jcvi_group and vax_date_eligible (grouping_variables.py) are
+# categorised_as() over ordered rule tables read from
+# output/vax_jcvi_groups.csv.gz and output/vax_eligible_dates.csv.gz, where
+# each patient takes the first category whose rule holds. Here a rule table
+# is compiled once into a decision table: the rules' atomic conditions (a
+# comparison such as `vax_jcvi_age_1 >= 16`, or a flag such as
+# `cev_group`) are collected and deduplicated across rules, so each is
+# evaluated once over the whole population however many rules use it;
+# comparisons of a string column with literals, such as
+# `vax_cat_jcvi_group='01'`, are answered from one lookup of the column's
+# values; and the rules are applied in order as masks over the patients
+# still unmatched, so that where several rules hold the first one wins.
+
+import numpy as np
+
+from expressions import compile_tree, parse, truthy
+
+# Compiled decision tables, keyed on their categories and rules
+compiled_decision_tables = {}
+
+
+def atom_key(tree):
+    """
+    key identifying an atomic condition, the same for `a = 'x'` and `'x' = a`
+    """
+    if tree[0] == "compare" and tree[1] in ("=", "!=") and tree[2][0] == "literal" and tree[3][0] == "column":
+        return ("compare", tree[1], tree[3], tree[2])
+    return tree
+
+
+def string_equality(tree):
+    """
+    (column, literal) if an atom compares a column with a string literal for
+    (in)equality, else None
+    """
+    if tree[0] == "compare" and tree[1] in ("=", "!=") and tree[2][0] == "column" and tree[3][0] == "literal":
+        if tree[3][2] == "str":
+            return tree[2][1], tree[3][1]
+    return None
+
+
+class DecisionTable:
+    """
+    an ordered rule table compiled into deduplicated atomic conditions and
+    one boolean combination of them per rule
+    """
+
+    def __init__(self, category_definitions):
+        self.atoms = []
+        self.atom_positions = {}
+        self.rules = []
+        self.default = ""
+        for category, expression in category_definitions.items():
+            if expression.strip() == "DEFAULT":
+                self.default = str(category)
+                continue
+            self.rules.append((str(category), self.condition(parse(expression))))
+        self.compiled_atoms = [compile_tree(atom) for atom in self.atoms]
+        # string literals each column is compared with, encoded together
+        self.literals = {}
+        for atom in self.atoms:
+            equality = string_equality(atom)
+            if equality:
+                column, literal = equality
+                self.literals.setdefault(column, {}).setdefault(literal, len(self.literals[column]))
+
+    def condition(self, tree):
+        """
+        a rule's condition with its atomic conditions replaced by their
+        positions in self.atoms
+        """
+        if tree[0] in ("and", "or"):
+            return (tree[0], self.condition(tree[1]), self.condition(tree[2]))
+        if tree[0] == "not":
+            return ("not", self.condition(tree[1]))
+        key = atom_key(tree)
+        if key not in self.atom_positions:
+            self.atom_positions[key] = len(self.atoms)
+            self.atoms.append(key)
+        return ("atom", self.atom_positions[key])
+
+    def evaluate_atoms(self, columns, kinds, size):
+        encoded = {}
+        for column, literals in self.literals.items():
+            if kinds.get(column) == "str":
+                # each distinct value is looked up once, then indexed back
+                # (sorted as fixed-width strings, much faster than objects)
+                distinct, inverse = np.unique(np.asarray(columns[column]).astype(str), return_inverse=True)
+                codes = np.array([literals.get(value, -1) for value in distinct.tolist()], dtype=np.int64)
+                encoded[column] = np.broadcast_to(codes[inverse].reshape(-1), (size,))
+        values = []
+        for atom, compiled in zip(self.atoms, self.compiled_atoms):
+            equality = string_equality(atom)
+            if equality and equality[0] in encoded:
+                column, literal = equality
+                matched = encoded[column] == self.literals[column][literal]
+                values.append(matched if atom[1] == "=" else ~matched)
+            else:
+                values.append(np.broadcast_to(truthy(*compiled(columns, kinds)), (size,)))
+        return values
+
+    def combine(self, condition, atoms):
+        if condition[0] == "atom":
+            return atoms[condition[1]]
+        if condition[0] == "not":
+            return ~self.combine(condition[1], atoms)
+        left, right = self.combine(condition[1], atoms), self.combine(condition[2], atoms)
+        return (left & right) if condition[0] == "and" else (left | right)
+
+    def evaluate(self, columns, kinds, size):
+        """
+        category of each patient: the first rule that holds, else the
+        default category (or "")
+        """
+        atoms = self.evaluate_atoms(columns, kinds, size)
+        # the position of the first rule that holds (len(self.rules) if
+        # none) is the number of rules before it, counted as the rules that
+        # leave each patient still unmatched; categories are looked up once
+        unmatched = np.ones(size, dtype=bool)
+        chosen = np.zeros(size, dtype=np.int32)
+        for _, condition in self.rules:
+            unmatched &= ~self.combine(condition, atoms)
+            chosen += unmatched
+        labels = np.array([category for category, _ in self.rules] + [self.default], dtype=object)
+        return labels[chosen]
+
+
+def compile_decision_table(category_definitions):
+    """
+    the DecisionTable for a categorised_as() dictionary, compiled on first use
+    """
+    key = tuple((str(category), expression) for category, expression in category_definitions.items())
+    table = compiled_decision_tables.get(key)
+    if table is None:
+        table = compiled_decision_tables[key] = DecisionTable(category_definitions)
+    return table
+
+
+def evaluate_decision_table(category_definitions, columns, kinds, size):
+    """
+    evaluate a categorised_as() dictionary as a decision table
+    """
+    return compile_decision_table(category_definitions).evaluate(columns, kinds, size)
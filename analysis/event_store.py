@@ -0,0 +1,236 @@
+# Local columnar event store
+#
+# Holds extracts of the record tables the study definitions query, so that
+# they can be evaluated offline by local_engine.py. Each table is a directory
+# of .npy files, one per column, with rows sorted by (patient_id, date) and
+# dates stored as int32 days since 1970-01-01. Columns are memory-mapped when
+# read, so a query only touches the columns it needs.
+#
+# A store can be built from CSV extracts (one <table>.csv or <table>.csv.gz
+# per table, with the columns listed in `tables` and dates as YYYY-MM-DD):
+#   python analysis/event_store.py <csv directory> <store directory>
+
+import csv
+import gzip
+import os
+import sys
+
+import numpy as np
+
+# Missing dates take the smallest int32 so that, like the empty string in
+# cohortextractor, they compare as earlier than any recorded date
+missing_date = np.iinfo(np.int32).min
+# Upper bound for open-ended windows and ongoing registrations
+maximum_date = np.iinfo(np.int32).max
+
+epoch = np.datetime64("1970-01-01", "D")
+
+# Values read as missing from CSV files: cohortextractor writes '', while
+# readr::write_csv (e.g. index_dates.csv.gz from prelim.R) writes NA
+missing_values = ("", "NA")
+
+# Column types of each table; "date" columns are int32 days, "str" columns
+# are numpy unicode arrays
+tables = {
+    "patients": {
+        "patient_id": "int",
+        "sex": "str",
+        "date_of_birth": "date",
+        "primary_care_death_date": "date",
+        "healthcare_worker": "int",
+    },
+    "registrations": {
+        "patient_id": "int",
+        "start_date": "date",
+        "end_date": "date",
+        "nuts1_region_name": "str",
+    },
+    "addresses": {
+        "patient_id": "int",
+        "start_date": "date",
+        "end_date": "date",
+        "index_of_multiple_deprivation": "int",
+        "is_potential_care_home": "int",
+        "location_requires_nursing": "str",
+        "location_does_not_require_nursing": "str",
+    },
+    "clinical_events": {
+        "patient_id": "int",
+        "date": "date",
+        "system": "str",
+        "code": "str",
+        "numeric_value": "float",
+    },
+    "medications": {
+        "patient_id": "int",
+        "date": "date",
+        "code": "str",
+    },
+    "apcs": {
+        "patient_id": "int",
+        "date": "date",
+        "primary_diagnosis": "str",
+        "diagnoses": "str",
+    },
+    "ons_deaths": {
+        "patient_id": "int",
+        "date": "date",
+        "underlying_cause": "str",
+        "causes": "str",
+    },
+    "sgss": {
+        "patient_id": "int",
+        "date": "date",
+        "pathogen": "str",
+        "result": "str",
+    },
+    "vaccinations": {
+        "patient_id": "int",
+        "date": "date",
+        "target_disease": "str",
+        "product_name": "str",
+    },
+    "sus_ethnicity": {
+        "patient_id": "int",
+        "date": "date",
+        "group_6": "str",
+    },
+    "gp_consultations": {
+        "patient_id": "int",
+        "date": "date",
+    },
+}
+
+
+def date_to_days(value):
+    """
+    convert a YYYY-MM-DD string to days since 1970-01-01
+    """
+    return int((np.datetime64(value, "D") - epoch).astype(np.int64))
+
+
+def dates_to_days(values):
+    """
+    convert an array of YYYY-MM-DD strings ('' or NA for missing) to int32
+    days
+    """
+    values = np.asarray(values, dtype=str)
+    days = np.full(values.shape, missing_date, dtype=np.int32)
+    present = ~np.isin(values, missing_values)
+    days[present] = (values[present].astype("datetime64[D]") - epoch).astype(np.int32)
+    return days
+
+
+def days_to_dates(days, date_format="YYYY-MM-DD"):
+    """
+    format int32 days as strings in a cohortextractor date_format, with ''
+    for missing dates
+    """
+    days = np.asarray(days)
+    present = (days != missing_date) & (days != maximum_date)
+    formatted = np.full(days.shape, "", dtype=object)
+    unit = {"YYYY": "Y", "YYYY-MM": "M"}.get(date_format, "D")
+    dates = (epoch + days[present].astype("timedelta64[D]")).astype(f"datetime64[{unit}]")
+    formatted[present] = dates.astype(str)
+    return formatted
+
+
+class EventStore:
+    """
+    directory of columnar tables sorted by (patient_id, date)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.loaded = {}
+
+    def table_path(self, name):
+        return os.path.join(self.path, name)
+
+    def has_table(self, name):
+        return os.path.isdir(self.table_path(name))
+
+    def write_table(self, name, columns):
+        """
+        write a table from a {column: array} dictionary, sorting the rows
+        """
+        schema = tables[name]
+        missing = set(schema) - set(columns)
+        if missing:
+            raise ValueError(f"Table {name} is missing columns {sorted(missing)}")
+        # np.lexsort sorts by its last key first
+        sort_keys = [columns["patient_id"]]
+        for date_column in ("date", "start_date"):
+            if date_column in schema:
+                sort_keys.insert(0, columns[date_column])
+        order = np.lexsort(sort_keys)
+        os.makedirs(self.table_path(name), exist_ok=True)
+        for column, kind in schema.items():
+            values = np.asarray(columns[column])
+            if kind == "date":
+                values = values.astype(np.int32)
+            elif kind == "int":
+                values = values.astype(np.int64)
+            elif kind == "float":
+                values = values.astype(np.float64)
+            else:
+                values = values.astype(str)
+            np.save(os.path.join(self.table_path(name), f"{column}.npy"), values[order])
+        self.loaded.pop(name, None)
+
+    def column(self, name, column):
+        """
+        return one column of a table, memory-mapped
+        """
+        key = (name, column)
+        if key not in self.loaded:
+            self.loaded[key] = np.load(
+                os.path.join(self.table_path(name), f"{column}.npy"), mmap_mode="r"
+            )
+        return self.loaded[key]
+
+    def table(self, name, columns=None):
+        """
+        return a {column: array} dictionary for (some of the columns of) a table
+        """
+        return {column: self.column(name, column) for column in (columns or tables[name])}
+
+
+def read_csv_table(path, schema):
+    """
+    read a CSV extract into typed columns
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="") as f:
+        rows = list(csv.DictReader(f))
+    columns = {}
+    for column, kind in schema.items():
+        values = [row.get(column) or "" for row in rows]
+        if kind == "date":
+            columns[column] = dates_to_days(values)
+        elif kind == "int":
+            columns[column] = np.array([int(value or 0) for value in values], dtype=np.int64)
+        elif kind == "float":
+            columns[column] = np.array([float(value or 0) for value in values], dtype=np.float64)
+        else:
+            columns[column] = np.array(values, dtype=str)
+    return columns
+
+
+def build_event_store(csv_directory, store_directory):
+    """
+    build an event store from a directory of CSV extracts, skipping tables
+    that have no extract
+    """
+    store = EventStore(store_directory)
+    for name, schema in tables.items():
+        for extension in (".csv.gz", ".csv"):
+            path = os.path.join(csv_directory, name + extension)
+            if os.path.exists(path):
+                store.write_table(name, read_csv_table(path, schema))
+                break
+    return store
+
+
+if __name__ == "__main__":
+    build_event_store(sys.argv[1], sys.argv[2])
@@ -0,0 +1,386 @@
+# Evaluator for categorised_as() and satisfying() expressions
+#
+# Supports the restricted expression language cohortextractor accepts, e.g.
+#   "(NOT dmres_date AND diab_date) OR (dmres_date < diab_date)"
+#   "most_recent_smoking_code = 'N' AND NOT ever_smoked"
+#   "index_of_multiple_deprivation >=32844*1/10"
+# evaluated over whole columns at once. As in cohortextractor, a missing
+# value takes the empty value of its column ('' for strings and dates, 0 for
+# numbers), so a missing date compares as earlier than any recorded date.
+# Each expression is parsed once and compiled into nested closures over
+# whole columns (see compile_expression()).
+
+import re
+
+import numpy as np
+
+from event_store import date_to_days, missing_date
+
+token_pattern = re.compile(
+    r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<string>'[^']*'|"[^"]*")
+      | (?P<operator><=|>=|!=|<>|=|<|>|\+|-|\*|/|\(|\))
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    )
+    """,
+    re.VERBOSE,
+)
+
+comparison_operators = {"=", "!=", "<>", "<", "<=", ">", ">="}
+keywords = {"AND", "OR", "NOT"}
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def tokenize(expression):
+    """
+    split an expression into (kind, value) tokens
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = token_pattern.match(expression, position)
+        if not match or match.end() == position:
+            raise ExpressionError(f"Unexpected input at {expression[position:]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "name" and value.upper() in keywords:
+            kind, value = "keyword", value.upper()
+        tokens.append((kind, value))
+    return tokens
+
+
+class Parser:
+    """
+    recursive descent parser producing a tuple-based syntax tree
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, value):
+        kind, found = self.take()
+        if found != value:
+            raise ExpressionError(f"Expected {value!r} in {self.expression!r}")
+
+    def parse(self):
+        tree = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ExpressionError(f"Unexpected {self.peek()[1]!r} in {self.expression!r}")
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.peek() == ("keyword", "OR"):
+            self.take()
+            tree = ("or", tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_not()
+        while self.peek() == ("keyword", "AND"):
+            self.take()
+            tree = ("and", tree, self.parse_not())
+        return tree
+
+    def parse_not(self):
+        if self.peek() == ("keyword", "NOT"):
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        tree = self.parse_sum()
+        kind, value = self.peek()
+        if kind == "operator" and value in comparison_operators:
+            self.take()
+            tree = ("compare", "!=" if value == "<>" else value, tree, self.parse_sum())
+        return tree
+
+    def parse_sum(self):
+        tree = self.parse_product()
+        while self.peek() in (("operator", "+"), ("operator", "-")):
+            tree = ("arithmetic", self.take()[1], tree, self.parse_product())
+        return tree
+
+    def parse_product(self):
+        tree = self.parse_unary()
+        while self.peek() in (("operator", "*"), ("operator", "/")):
+            tree = ("arithmetic", self.take()[1], tree, self.parse_unary())
+        return tree
+
+    def parse_unary(self):
+        if self.peek() == ("operator", "-"):
+            self.take()
+            return ("negate", self.parse_unary())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.take()
+        if kind == "number":
+            return ("literal", float(value) if "." in value else int(value), "float" if "." in value else "int")
+        if kind == "string":
+            return ("literal", value[1:-1], "str")
+        if kind == "name":
+            return ("column", value)
+        if (kind, value) == ("operator", "("):
+            tree = self.parse_or()
+            self.expect(")")
+            return tree
+        raise ExpressionError(f"Unexpected {value!r} in {self.expression!r}")
+
+
+# Syntax trees and compiled expressions, keyed on the expression text, so
+# that the same rule used by several variables (or evaluated for several
+# cohorts) is parsed and compiled once; the text is used as it is, since
+# whitespace inside string literals is significant
+parsed_expressions = {}
+compiled_expressions = {}
+
+
+def parse(expression):
+    """
+    parse an expression into a syntax tree (parsed once per expression)
+    """
+    tree = parsed_expressions.get(expression)
+    if tree is None:
+        tree = parsed_expressions[expression] = Parser(expression).parse()
+    return tree
+
+
+def referenced_columns(tree):
+    """
+    names of the columns an expression refers to
+    """
+    if tree[0] == "column":
+        return {tree[1]}
+    if tree[0] == "literal":
+        return set()
+    names = set()
+    for child in tree[1:]:
+        if isinstance(child, tuple):
+            names |= referenced_columns(child)
+    return names
+
+
+def truthy(values, kind):
+    """
+    boolean array of which values are present/non-zero
+    """
+    if kind == "bool":
+        return values
+    if kind == "date":
+        return values != missing_date
+    if kind == "str":
+        return values != ""
+    return values != 0
+
+
+def coerce_literal(values, kind, other_kind):
+    """
+    convert a literal to the kind of the column it is compared with
+    """
+    if kind == "str" and other_kind == "date":
+        return np.int32(date_to_days(values) if values else missing_date), "date"
+    if kind in ("int", "float") and other_kind == "str":
+        return str(values), "str"
+    return values, kind
+
+
+def compare_values(operator, left, right):
+    if operator == "=":
+        return left == right
+    if operator == "!=":
+        return left != right
+    if operator == "<":
+        return left < right
+    if operator == "<=":
+        return left <= right
+    if operator == ">":
+        return left > right
+    return left >= right
+
+
+def arithmetic_values(operator, left, left_kind, right, right_kind):
+    if operator == "+":
+        return left + right, left_kind
+    if operator == "-":
+        return left - right, left_kind
+    if operator == "*":
+        return left * right, left_kind
+    # integer division truncates, as in SQL
+    if left_kind == "int" and right_kind == "int":
+        return np.floor_divide(left, right), "int"
+    return np.true_divide(left, right), "float"
+
+
+def compile_tree(tree):
+    """
+    compile a syntax tree into a function of (columns, kinds) returning
+    (values, kind), so that evaluating it does no parsing or tree walking
+    beyond one call per node
+    """
+    node = tree[0]
+    if node == "literal":
+        _, value, kind = tree
+        return lambda columns, kinds: (value, kind)
+    if node == "column":
+        name = tree[1]
+
+        def column(columns, kinds):
+            if name not in columns:
+                raise ExpressionError(f"Unknown column {name!r}")
+            return columns[name], kinds[name]
+
+        return column
+    if node == "not":
+        operand = compile_tree(tree[1])
+        return lambda columns, kinds: (~truthy(*operand(columns, kinds)), "bool")
+    if node in ("and", "or"):
+        left, right = compile_tree(tree[1]), compile_tree(tree[2])
+        if node == "and":
+            return lambda columns, kinds: (
+                truthy(*left(columns, kinds)) & truthy(*right(columns, kinds)),
+                "bool",
+            )
+        return lambda columns, kinds: (truthy(*left(columns, kinds)) | truthy(*right(columns, kinds)), "bool")
+    if node == "negate":
+        operand = compile_tree(tree[1])
+
+        def negate(columns, kinds):
+            values, kind = operand(columns, kinds)
+            return -values, kind
+
+        return negate
+    operator = tree[1]
+    left, right = compile_tree(tree[2]), compile_tree(tree[3])
+    if node == "arithmetic":
+
+        def arithmetic(columns, kinds):
+            return arithmetic_values(operator, *left(columns, kinds), *right(columns, kinds))
+
+        return arithmetic
+    left_literal = tree[2][0] == "literal"
+    right_literal = tree[3][0] == "literal"
+    # literals converted to the kind of the other side, once per kind
+    coerced = {}
+
+    def coerce(side, values, kind, other_kind):
+        key = (side, other_kind)
+        if key not in coerced:
+            coerced[key] = coerce_literal(values, kind, other_kind)
+        return coerced[key]
+
+    def comparison(columns, kinds):
+        left_values, left_kind = left(columns, kinds)
+        right_values, right_kind = right(columns, kinds)
+        if left_literal:
+            left_values, left_kind = coerce("left", left_values, left_kind, right_kind)
+        if right_literal:
+            right_values, right_kind = coerce("right", right_values, right_kind, left_kind)
+        return np.asarray(compare_values(operator, left_values, right_values), dtype=bool), "bool"
+
+    return comparison
+
+
+def compile_expression(expression):
+    """
+    the compiled form of an expression, compiled on first use
+    """
+    compiled = compiled_expressions.get(expression)
+    if compiled is None:
+        compiled = compiled_expressions[expression] = compile_tree(parse(expression))
+    return compiled
+
+
+def evaluate(expression, columns, kinds, size):
+    """
+    evaluate an expression over columns of length size, returning a boolean
+    array
+    """
+    values, kind = compile_expression(expression)(columns, kinds)
+    return np.broadcast_to(truthy(values, kind), (size,)).copy()
+
+
+def evaluate_categories(category_definitions, columns, kinds, size):
+    """
+    evaluate a categorised_as() dictionary: each patient gets the first
+    category whose expression is true, else the DEFAULT category (or "")
+    """
+    result = np.full(size, "", dtype=object)
+    assigned = np.zeros(size, dtype=bool)
+    default = ""
+    for category, expression in category_definitions.items():
+        if expression.strip() == "DEFAULT":
+            default = str(category)
+            continue
+        matched = evaluate(expression, columns, kinds, size) & ~assigned
+        result[matched] = str(category)
+        assigned |= matched
+    result[~assigned] = default
+    return result
+
+
+def resolve_ethnicity(n_groups, columns, kinds, size):
+    """
+    evaluate generate_ethnicity_dictionary(n_groups) directly: the group of
+    whichever GP source (opensafely or primis) compares as more recent, or
+    the SUS group if neither GP source is recorded, lowest group first
+    where more than one applies, else "0"
+
+    As in the dictionary, each source's group and its "date" are compared
+    as the values of their columns (the *_date columns return the category
+    rather than a date), so both comparisons are evaluated once, rather than
+    once per group.
+    """
+    sus, opensafely, primis = (
+        columns[name] for name in ("cov_ethnicity_sus", "cov_ethnicity_gp_opensafely", "cov_ethnicity_gp_primis")
+    )
+    opensafely_date = columns["cov_ethnicity_gp_opensafely_date"]
+    primis_date = columns["cov_ethnicity_gp_primis_date"]
+    neither_recorded = np.asarray((opensafely == "") & (primis == ""), dtype=bool)
+    candidates = [
+        (sus, neither_recorded),
+        (opensafely, np.asarray(opensafely_date >= primis_date, dtype=bool)),
+        (primis, np.asarray(primis_date > opensafely_date, dtype=bool)),
+    ]
+    # each source's group as a number (n_groups + 1 for none), looked up once
+    # per distinct value, and the lowest group any applicable source gives
+    none = n_groups + 1
+    groups = {str(n): n for n in range(1, n_groups + 1)}
+    resolved = np.full(size, none, dtype=np.int64)
+    for values, applies in candidates:
+        distinct, inverse = np.unique(np.asarray(values).astype(str), return_inverse=True)
+        group = np.array([groups.get(value, none) for value in distinct.tolist()], dtype=np.int64)[inverse]
+        np.minimum(resolved, np.where(applies, group, none), out=resolved)
+    labels = np.array(["0"] + list(groups) + ["0"], dtype=object)
+    return labels[resolved]
+
+
+def bucket_by_cutpoints(values, cutpoints):
+    """
+    category of each value given the ascending lower bounds of categories
+    "1", "2", ...: the number of cutpoints at or below it, found by binary
+    search, with "0" for values below the first
+    """
+    buckets = np.searchsorted(np.asarray(cutpoints), values, side="right")
+    labels = np.array([str(n) for n in range(len(cutpoints) + 1)], dtype=object)
+    return labels[buckets]
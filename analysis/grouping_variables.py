@@ -6,29 +6,59 @@ from cohortextractor import (
 )
 
 # import codelists.py script
-from codelists import *
+from codelists import (
+    bmi_primis,
+    learndis_primis,
+    longres_primis,
+    shield_primis,
+    nonshield_primis,
+    preg_primis,
+    pregdel_primis,
+    ast_primis,
+    bmi_stage_primis,
+    sev_obesity_primis,
+    astadm_primis,
+    astrx_primis,
+    resp_primis,
+    cns_primis,
+    chd_primis,
+    spln_primis,
+    diab_primis,
+    dmres_primis,
+    sev_mental_primis,
+    smhres_primis,
+    ckd_primis,
+    ckd15_primis,
+    ckd35_primis,
+    cld_primis,
+    immdx_primis,
+    immrx_primis,
+)
 
 # import json module
 import json
 
-import pandas as pd
+import csv
+import gzip
 
 ### import groups and dates
+# (read with csv rather than pandas, which is slow to import)
+def read_grouping_file(path):
+  """
+  rows of a gzipped CSV file of JCVI groups or eligibility dates
+  """
+  with gzip.open(path, "rt", newline="") as f:
+    return list(csv.DictReader(f))
+
 # jcvi_groups
-jcvi_groups = pd.read_csv(
-    filepath_or_buffer='output/vax_jcvi_groups.csv.gz',
-    dtype=str
-)
-dict_jcvi = {jcvi_groups['group'][i]: jcvi_groups['definition'][i] for i in jcvi_groups.index}
-ratio_jcvi = {jcvi_groups['group'][i]: 1/len(jcvi_groups.index) for i in jcvi_groups.index}
+jcvi_groups = read_grouping_file("output/vax_jcvi_groups.csv.gz")
+dict_jcvi = {row["group"]: row["definition"] for row in jcvi_groups}
+ratio_jcvi = {row["group"]: 1/len(jcvi_groups) for row in jcvi_groups}
 
 # elig_dates
-elig_dates = pd.read_csv(
-    filepath_or_buffer='output/vax_eligible_dates.csv.gz',
-    dtype=str
-)
-dict_elig = { elig_dates['date'][i] : elig_dates['description'][i] for i in elig_dates.index }
-ratio_elig = { elig_dates['date'][i] : 1/len(elig_dates.index) for i in elig_dates.index }
+elig_dates = read_grouping_file("output/vax_eligible_dates.csv.gz")
+dict_elig = {row["date"]: row["description"] for row in elig_dates}
+ratio_elig = {row["date"]: 1/len(elig_dates) for row in elig_dates}
 
 #study_dates
 with open("output/study_dates.json") as f:
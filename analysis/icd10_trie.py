@@ -0,0 +1,104 @@
+# Prefix trie over the project's ICD-10 codelists
+#
+# Hospital spells (APCS) and death certificates record diagnoses as ICD-10
+# codes, and a codelist entry matches any recorded code it is a prefix of
+# (e.g. "F32" matches "F320" and "F32X"). Rather than testing each spell once
+# per variable, all ICD-10 codelists are loaded into a single trie and every
+# diagnosis string is matched against all of them in one pass.
+
+import re
+
+import numpy as np
+
+from codelists import codelist_definitions, load_codelist
+
+# Diagnosis fields hold several codes separated by punctuation/whitespace,
+# e.g. "||F320 ,I10X ,Z864 ||J128"
+code_characters = re.compile(r"[A-Za-z0-9]")
+
+# Key under which a trie node stores the codelists ending at that node
+codelists_key = None
+
+
+class ICD10Trie:
+    """
+    prefix trie mapping ICD-10 code prefixes to the codelists containing them
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.names = []
+
+    def add_codelist(self, name, codes):
+        """
+        add every code of a codelist, tagged with the codelist name
+        """
+        self.names.append(name)
+        for code in codes:
+            node = self.root
+            for character in code.strip().upper():
+                node = node.setdefault(character, {})
+            node.setdefault(codelists_key, set()).add(name)
+
+    def match(self, diagnoses):
+        """
+        return the set of codelist names with a code that prefixes any of the
+        codes in a diagnosis string, walking the string once
+        """
+        matched = set()
+        node = None
+        for character in diagnoses.upper():
+            if not code_characters.match(character):
+                # separator: the next code character starts a new code
+                node = None
+                continue
+            if node is None:
+                node = self.root
+            elif node is False:
+                # this code has already left the trie
+                continue
+            node = node.get(character, False)
+            if node is not False and codelists_key in node:
+                matched.update(node[codelists_key])
+        return matched
+
+    def match_all(self, diagnoses):
+        """
+        match an array of diagnosis strings, returning a boolean array per
+        codelist name aligned with the input
+        """
+        masks = {name: np.zeros(len(diagnoses), dtype=bool) for name in self.names}
+        # spells frequently share a diagnosis string, so match each once
+        cache = {}
+        for row, value in enumerate(diagnoses):
+            if not value:
+                continue
+            matched = cache.get(value)
+            if matched is None:
+                matched = cache[value] = self.match(value)
+            for name in matched:
+                masks[name][row] = True
+        return masks
+
+
+def codelist_system(name):
+    """
+    coding system of a registered codelist, without parsing it
+    """
+    definition = codelist_definitions[name]
+    if "combine" in definition:
+        return codelist_system(definition["combine"][0])
+    return definition["system"]
+
+
+def build_icd10_trie(names=None):
+    """
+    build a trie from the named ICD-10 codelists, or from every registered
+    ICD-10 codelist if no names are given
+    """
+    if names is None:
+        names = [name for name in codelist_definitions if codelist_system(name) == "icd10"]
+    trie = ICD10Trie()
+    for name in names:
+        trie.add_codelist(name, load_codelist(name))
+    return trie
@@ -0,0 +1,116 @@
+# Import-time budget for the study definition modules
+#
+# cohortextractor imports each study definition before it extracts anything,
+# so module-level work (reading files, parsing codelists, building variables)
+# is paid on every generate_cohort run. Each module below is imported in a
+# fresh interpreter with `python -X importtime`, and the time spent in this
+# project's own modules (excluding cohortextractor, pandas, numpy and other
+# libraries) is compared with its budget. Budgets are relative to the time
+# taken to import cohortextractor itself, measured in the same run, so that
+# they hold on slower or busier machines. Run from the project root:
+#   python analysis/import_budget.py [<module> ...]
+# The exit status is 1 if any module is over budget.
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+analysis_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Budgets as fractions of the baseline import time. Calibrated with a warm
+# codelist cache and the real cohortextractor as the median of five runs of
+# each module over the median of five baseline runs (the larger of two such
+# calibrations), then doubled and rounded up. The study definitions' share is
+# large because their own time includes the StudyDefinition processing that
+# cohortextractor does when each study definition builds `study`
+baseline_module = "cohortextractor"
+import_budgets = {
+    "codelists": 0.001,
+    "grouping_variables": 0.01,
+    "common_variables": 0.02,
+    "study_definition_prelim": 0.25,
+    "study_definition_vax": 1.2,
+    "study_definition_unvax": 0.9,
+    "study_definition_unvax_extf": 0.9,
+    "study_definition_prevax": 0.9,
+    "study_definition_prevax_extf": 0.9,
+}
+
+# Runs of each import, of which the median is taken
+repeats = 3
+
+importtime_line = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def project_modules():
+    return {name[:-3] for name in os.listdir(analysis_directory) if name.endswith(".py")}
+
+
+def run_python(arguments, cwd=None):
+    """
+    run a fresh interpreter with this directory on PYTHONPATH, as
+    cohortextractor imports the study definitions, returning the completed
+    process
+    """
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [analysis_directory] + [path for path in [environment.get("PYTHONPATH")] if path]
+    )
+    result = subprocess.run([sys.executable, *arguments], env=environment, cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Running {' '.join(arguments)} failed:\n{result.stderr}")
+    return result
+
+
+def import_times(module):
+    """
+    microseconds spent importing a module in a fresh interpreter, as
+    (project modules' own time, total time, {module: own time})
+    """
+    result = run_python(["-X", "importtime", "-c", f"import {module}"])
+    own = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = importtime_line.match(line)
+        if not match:
+            continue
+        self_time, cumulative, indent, name = match.groups()
+        if name == module:
+            total = int(cumulative)
+        if name in project_modules():
+            own[name] = int(self_time)
+    return sum(own.values()), total, own
+
+
+def median_import_times(module):
+    """
+    import_times() of the run with the median project time of `repeats` runs
+    """
+    runs = sorted((import_times(module) for _ in range(repeats)), key=lambda run: run[0])
+    return runs[len(runs) // 2]
+
+
+def main(*modules):
+    baseline = statistics.median(import_times(baseline_module)[1] for _ in range(repeats))
+    print(f"{baseline_module:32} total {baseline / 1000:7.1f}ms (baseline)")
+    over = False
+    for module in modules or import_budgets:
+        project, total, own = median_import_times(module)
+        fraction = import_budgets.get(module)
+        budget = None if fraction is None else fraction * baseline / 1000
+        status = "" if budget is None else ("OVER" if project / 1000 > budget else "ok")
+        over |= status == "OVER"
+        heaviest = ", ".join(
+            f"{name} {time / 1000:.0f}ms" for name, time in sorted(own.items(), key=lambda item: -item[1])[:3]
+        )
+        print(
+            f"{module:32} project {project / 1000:7.1f}ms  total {total / 1000:7.1f}ms  "
+            f"budget {f'{budget:.1f}' if budget is not None else '-':>7}ms {status:4}  ({heaviest})"
+        )
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
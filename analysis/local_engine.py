@@ -0,0 +1,841 @@
+# Local engine for evaluating study definitions offline
+#
+# Evaluates the `patients.*` variables used by the study definitions in this
+# project against a local columnar event store (see event_store.py) rather
+# than the TPP database, so that whole extractions can be run, timed and
+# tuned locally. Results follow cohortextractor's conventions: one row per
+# patient, missing dates/strings as '' and missing numbers as 0.
+#
+# Usage:
+#   python analysis/local_engine.py <study definition> <store directory> <output file> [<workers>] [--drop-temporary] [--active-analyses]
+# e.g.
+#   python analysis/local_engine.py study_definition_vax local_store output/input_vax.csv.gz
+# Variables are evaluated concurrently, level by level of their dependency
+# graph, by <workers> threads (by default, one per CPU). With
+# --drop-temporary, tmp_* variables that only feed other variables are
+# computed but not written, except those downstream scripts read. With
+# --active-analyses, outcome columns that no analysis of the cohort in
+# lib/active_analyses.csv uses are neither evaluated nor written (see
+# column_projection.py). An output file ending .parquet is written as
+# Parquet, typed by the cohort schema (see cohort_parquet.py).
+
+import csv
+import gzip
+import importlib
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import numpy as np
+
+from code_dictionary import build_code_dictionaries, code_dictionary, codes_in
+from cohort_parquet import write_parquet
+from cohort_schema import cohort_schema, schema_path, write_schema
+from column_projection import projected_out_columns, read_active_analyses
+from event_store import (
+    EventStore,
+    date_to_days,
+    dates_to_days,
+    days_to_dates,
+    maximum_date,
+    missing_date,
+    tables,
+)
+from decision_tables import evaluate_decision_table
+from expressions import bucket_by_cutpoints, evaluate, resolve_ethnicity
+from icd10_trie import ICD10Trie
+from query_planner import fused_event_mask, fusion_key, plan_fused_queries
+from study_definition_helper_functions import (
+    deprivation_dictionary_ntiles,
+    deprivation_ntile_cutpoints,
+    ethnicity_dictionary_groups,
+)
+from value_files import load_value_file
+from variable_definitions import (
+    date_expression_pattern,
+    dependency_graph,
+    temporary_variables,
+    topological_levels,
+    unneeded_variables,
+)
+from window_kernels import no_match, windowed_matches
+
+# Earliest date an event window can start from
+earliest_date = missing_date + 1
+
+# Columns that are computed but not written out (variables defined inside
+# categorised_as()/satisfying() are tracked separately, as hidden)
+not_written = {"population"}
+
+# tmp_* columns that downstream scripts read, so are written even when
+# temporary columns are dropped: preprocess_data.R keeps the
+# tmp_out_date_<outcome>_snomed/_hes/_death sources for venn.R
+required_temporary_prefixes = ("tmp_out_date_",)
+
+# SNOMED CT code of recorded body mass index values
+bmi_code = "60621009"
+
+# Event queries that always return one kind of value
+event_returning = {"most_recent_bmi": "numeric_value"}
+
+# Kind of the values of each cohortextractor column_type (0/1 flags are held
+# as ints)
+column_type_kinds = {"bool": "int", "int": "int", "float": "float", "str": "str", "date": "date"}
+
+# Empty value of each kind, which aggregate_of() ignores as tpp_backend does
+empty_values = {"int": 0, "float": 0.0, "str": "", "date": missing_date}
+
+
+def add_months(days, months):
+    """
+    add a number of calendar months to int32 days, clamping to the end of
+    the month (e.g. 2021-03-31 - 1 month = 2021-02-28)
+    """
+    dates = np.datetime64("1970-01-01", "D") + np.asarray(days).astype("timedelta64[D]")
+    month_starts = dates.astype("datetime64[M]")
+    day_of_month = (dates - month_starts.astype("datetime64[D]")).astype(np.int64)
+    shifted = month_starts + np.timedelta64(months, "M")
+    month_length = ((shifted + 1).astype("datetime64[D]") - shifted.astype("datetime64[D]")).astype(np.int64)
+    shifted_dates = shifted.astype("datetime64[D]") + np.minimum(day_of_month, month_length - 1)
+    return (shifted_dates - np.datetime64("1970-01-01", "D")).astype(np.int32)
+
+
+def satisfying_expression(category_definitions):
+    """
+    the expression of a satisfying(), which StudyDefinition processes into
+    categorised_as({1: expression, 0: "DEFAULT"}), or None for other
+    categorised_as() dictionaries
+    """
+    if set(category_definitions) == {0, 1} and category_definitions[0].strip() == "DEFAULT":
+        return category_definitions[1]
+    return None
+
+
+def category_values(categories, kind):
+    """
+    convert an array of categories (as strings) to values of a kind
+    """
+    if kind == "str":
+        return categories
+    distinct, inverse = np.unique(np.asarray(categories).astype(str), return_inverse=True)
+    if kind == "date":
+        converted = dates_to_days(distinct)
+    else:
+        converted = distinct.astype(np.int64 if kind == "int" else np.float64)
+    return converted[inverse.reshape(-1)]
+
+
+def years_between(start_days, end_days):
+    """
+    whole years from start to end date, as for an age
+    """
+    def parts(days):
+        dates = np.datetime64("1970-01-01", "D") + np.asarray(days).astype("timedelta64[D]")
+        years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+        months = dates.astype("datetime64[M]").astype(np.int64) % 12
+        day_of_month = (dates - dates.astype("datetime64[M]").astype("datetime64[D]")).astype(np.int64)
+        return years, months, day_of_month
+
+    start_year, start_month, start_day = parts(start_days)
+    end_year, end_month, end_day = parts(end_days)
+    before_birthday = (end_month < start_month) | ((end_month == start_month) & (end_day < start_day))
+    return end_year - start_year - before_birthday
+
+
+class LocalEngine:
+    """
+    evaluates study definition variables against an EventStore
+    """
+
+    def __init__(self, store, index_date=None, today=None, drop_temporary=False, projection=None):
+        self.store = store
+        self.patient_ids = np.asarray(store.column("patients", "patient_id"))
+        self.size = len(self.patient_ids)
+        self.index_date = index_date
+        self.today = today or date.today().isoformat()
+        self.columns = {}
+        self.kinds = {}
+        self.date_formats = {}
+        self.match_dates = {}
+        self.hidden = set()
+        self.drop_temporary = drop_temporary
+        self.dropped = set()
+        # variables left out of the output, and those that then need not be evaluated
+        self.projection = set(projection or ())
+        self.skipped = set()
+        self.event_rows_cache = {}
+        self.code_ids_cache = {}
+        self.codelist_ids_cache = {}
+        # fused event queries (see query_planner.py) by fusion key, and the
+        # events each group's scan selected
+        self.fused_queries = {}
+        self.fused_selections = {}
+        self.icd10_codelists = {}
+        self.icd10_masks = {}
+        # guards the caches above when variables are evaluated concurrently
+        self.lock = threading.RLock()
+
+    # Patients and dates ----------------------------------------------------
+
+    def event_rows(self, table):
+        """
+        row of each event's patient in the patient list, and whether the
+        patient is in the list at all
+        """
+        with self.lock:
+            if table not in self.event_rows_cache:
+                patient_ids = np.asarray(self.store.column(table, "patient_id"))
+                rows = np.searchsorted(self.patient_ids, patient_ids)
+                rows = np.minimum(rows, max(self.size - 1, 0))
+                known = self.patient_ids[rows] == patient_ids if self.size else np.zeros(len(rows), dtype=bool)
+                self.event_rows_cache[table] = (rows, known)
+            return self.event_rows_cache[table]
+
+    def resolve_date(self, expression):
+        """
+        resolve a date expression to an int32 scalar or per-patient array
+        """
+        match = date_expression_pattern.match(expression)
+        if not match:
+            raise ValueError(f"Unsupported date expression {expression!r}")
+        reference = match.group("reference")
+        if reference == "index_date":
+            value = np.int32(date_to_days(self.index_date))
+        elif reference == "today":
+            value = np.int32(date_to_days(self.today))
+        elif re.match(r"\d{4}-\d{2}-\d{2}$", reference):
+            value = np.int32(date_to_days(reference))
+        elif self.kinds.get(reference) == "date":
+            value = self.columns[reference]
+        elif reference in self.match_dates:
+            value = self.match_dates[reference]
+        else:
+            raise ValueError(f"Unknown date {reference!r} in {expression!r}")
+        if not match.group("sign"):
+            return value
+        number = int(match.group("number")) * (1 if match.group("sign") == "+" else -1)
+        unit = match.group("unit").rstrip("s")
+        present = value != missing_date
+        if unit == "day":
+            shifted = np.where(present, np.asarray(value, dtype=np.int64) + number, missing_date)
+        else:
+            months = number * (12 if unit == "year" else 1)
+            shifted = np.where(present, add_months(np.where(present, value, 0), months), missing_date)
+        return shifted.astype(np.int32) if np.ndim(shifted) else np.int32(shifted)
+
+    def resolve_window(self, arguments):
+        """
+        per-patient (low, high) date bounds from `between` (into which
+        StudyDefinition turns on_or_before/on_or_after, with None for an open
+        bound); patients whose bounds are missing match nothing
+        """
+        low, high = np.int32(earliest_date), np.int32(maximum_date)
+        start, end = arguments.get("between") or (None, None)
+        if start:
+            low = self.resolve_date(start)
+        if end:
+            high = self.resolve_date(end)
+        low = np.where(low == missing_date, maximum_date, low)
+        return np.broadcast_to(low, (self.size,)), np.broadcast_to(high, (self.size,))
+
+    def windowed_matches(self, table, mask, arguments, date_column="date"):
+        """
+        first/last match and count of the events selected by mask that fall
+        within the window of their patient (see window_kernels.py)
+        """
+        rows, known = self.event_rows(table)
+        low, high = self.resolve_window(arguments)
+        dates = np.asarray(self.store.column(table, date_column))
+        return windowed_matches(rows, dates, mask & known, low, high, self.size)
+
+    # Code matching ---------------------------------------------------------
+
+    def intern_codelists(self, variables):
+        """
+        intern every codelist before any event codes are looked up: the
+        registered ones (see code_dictionary.build_code_dictionaries()) and
+        those the variables define inline, so that the dictionaries no longer
+        grow and each table's codes are looked up once
+        """
+        with self.lock:
+            build_code_dictionaries()
+            for query_type, arguments in variables.values():
+                if self.event_query(query_type) and getattr(arguments.get("codelist"), "system", None):
+                    self.codelist_ids(arguments["codelist"])
+
+    def codelist_ids(self, codelist):
+        """
+        sorted code ids of a codelist, interned on first use
+        """
+        with self.lock:
+            cached = self.codelist_ids_cache.get(id(codelist))
+            if cached is None or cached[0] is not codelist:
+                codes = [code for code, _ in codelist] if codelist.has_categories else list(codelist)
+                cached = self.codelist_ids_cache[id(codelist)] = (
+                    codelist,
+                    code_dictionary(codelist.system).encode(codes),
+                )
+            return cached[1]
+
+    def event_code_ids(self, table, system):
+        """
+        code ids of the events of a table in a coding system's dictionary,
+        looked up once (codes not in any codelist map to unknown_code_id)
+        """
+        with self.lock:
+            dictionary = code_dictionary(system)
+            key = (table, system)
+            cached = self.code_ids_cache.get(key)
+            # codes interned since the events were looked up (only codelists
+            # not seen by intern_codelists()) need a fresh lookup
+            if cached is None or cached[0] != len(dictionary):
+                event_ids = dictionary.lookup(np.asarray(self.store.column(table, "code")))
+                cached = self.code_ids_cache[key] = (len(dictionary), event_ids)
+            return cached[1]
+
+    def plan_event_queries(self, variables):
+        """
+        group the variables' event queries that differ only in their codelist
+        (see query_planner.py), so each group's events are scanned once
+        """
+        with self.lock:
+            for query in plan_fused_queries(variables):
+                if len(query.codelists) > 1:
+                    self.fused_queries[query.key] = query
+
+    def fused_masks(self, table, query_type, arguments):
+        """
+        mask of the events of a table matching a variable's codelist, taken
+        from one scan of the table shared by every variable in its fused
+        query; None if the variable is not part of one
+        """
+        key = fusion_key(query_type, arguments)
+        query = self.fused_queries.get(key)
+        if query is None:
+            return None
+        names = [name for name, codelist in query.codelists.items() if codelist is arguments["codelist"]]
+        if not names:
+            return None
+        with self.lock:
+            event_ids = self.event_code_ids(table, query.system)
+            if key not in self.fused_selections:
+                union = fused_event_mask(query, event_ids)
+                if "system" in tables[table]:
+                    union &= np.asarray(self.store.column(table, "system")) == query.system
+                selected = np.flatnonzero(union)
+                self.fused_selections[key] = (selected, query.fan_out(event_ids[selected]))
+            selected, fanned_out = self.fused_selections[key]
+        mask = np.zeros(len(event_ids), dtype=bool)
+        mask[selected[fanned_out[names[0]]]] = True
+        return mask
+
+    def codelist_mask(self, table, codelist):
+        """
+        boolean mask of the events of a table with a code in the codelist
+        """
+        codelist_ids = self.codelist_ids(codelist)
+        mask = codes_in(self.event_code_ids(table, codelist.system), codelist_ids)
+        if "system" in tables[table]:
+            mask &= np.asarray(self.store.column(table, "system")) == codelist.system
+        return mask
+
+    def register_icd10_codelists(self, variables):
+        """
+        collect the ICD-10 codelists of a study up front so that each
+        diagnosis column is matched against all of them in one pass
+        """
+        for query_type, arguments in variables.values():
+            for argument in ("with_these_diagnoses", "with_these_primary_diagnoses", "codelist"):
+                codelist = arguments.get(argument)
+                if codelist is not None and getattr(codelist, "system", None) == "icd10":
+                    self.icd10_codelists[str(id(codelist))] = codelist
+
+    def diagnosis_mask(self, table, column, codelist):
+        """
+        boolean mask of the rows of a table with an ICD-10 code in the column
+        matching (by prefix) a code in the codelist
+        """
+        key = str(id(codelist))
+        with self.lock:
+            self.icd10_codelists.setdefault(key, codelist)
+            masks = self.icd10_masks.get((table, column))
+            if masks is None or key not in masks:
+                trie = ICD10Trie()
+                for name, registered in self.icd10_codelists.items():
+                    trie.add_codelist(name, registered)
+                masks = self.icd10_masks[(table, column)] = trie.match_all(
+                    np.asarray(self.store.column(table, column)).tolist()
+                )
+            return masks[key]
+
+    # Selecting and summarising events -----------------------------------------
+
+    def event_query(self, query_type):
+        """
+        the select_<query type> method of a query over an events table, or
+        None for other queries
+        """
+        return getattr(self, f"select_{query_type}", None)
+
+    def summarise_events(self, name, table, matches, arguments, category_of=None):
+        """
+        summarise the matches of each patient (see window_kernels.py) as
+        requested by the `returning` argument
+        """
+        returning = arguments.get("returning") or "binary_flag"
+        last = not arguments.get("find_first_match_in_period")
+        self.match_dates[name] = matches.dates(self.store.column(table, "date"), last=last)
+
+        if returning == "binary_flag":
+            return matches.flag, "int"
+        if returning in ("date", "date_admitted", "date_of_death"):
+            return self.match_dates[name], "date"
+        if returning == "number_of_matches_in_period":
+            return matches.count, "int"
+        if returning == "numeric_value":
+            return matches.values(self.store.column(table, "numeric_value"), 0.0, last=last), "float"
+        if returning in ("code", "category", "primary_diagnosis", "underlying_cause"):
+            column = {"primary_diagnosis": "primary_diagnosis", "underlying_cause": "underlying_cause"}.get(returning, "code")
+            values = matches.values(self.store.column(table, column), "", last=last)
+            if returning == "category":
+                values = np.array([category_of.get(code, "") for code in values], dtype=object)
+            return values, "str"
+        raise NotImplementedError(f"returning={returning!r} is not supported for {table}")
+
+    def query_events(self, name, query_type, arguments):
+        """
+        evaluate a query over an events table: select the events it matches,
+        then match them against the window of each patient
+        """
+        table, mask, category_of, arguments = self.select_events(query_type, arguments)
+        matches = self.windowed_matches(table, mask, arguments)
+        return self.summarise_events(name, table, matches, arguments, category_of)
+
+    def select_events(self, query_type, arguments):
+        """
+        the table and mask of the events a query matches before windowing,
+        with the categories of their codes and the arguments to summarise
+        them with
+        """
+        table, mask, category_of = self.event_query(query_type)(arguments)
+        arguments = dict(arguments, returning=event_returning.get(query_type, arguments.get("returning")))
+        return table, mask, category_of, arguments
+
+    # Event selections: (table, mask of matching events, categories of codes),
+    # before windowing; these do not depend on any patient's columns
+
+    def select_with_these_clinical_events(
+        self, arguments, table="clinical_events", query_type="with_these_clinical_events"
+    ):
+        for unsupported in ("ignore_days_where_these_codes_occur", "episode_defined_as"):
+            if arguments.get(unsupported):
+                raise NotImplementedError(f"{unsupported} is not supported")
+        codelist = arguments["codelist"]
+        mask = self.fused_masks(table, query_type, arguments)
+        if mask is None:
+            mask = self.codelist_mask(table, codelist)
+        if arguments.get("ignore_missing_values") and "numeric_value" in tables[table]:
+            mask &= np.asarray(self.store.column(table, "numeric_value")) != 0
+        category_of = dict(codelist) if codelist.has_categories else None
+        return table, mask, category_of
+
+    def select_with_these_medications(self, arguments):
+        return self.select_with_these_clinical_events(
+            arguments, table="medications", query_type="with_these_medications"
+        )
+
+    def select_admitted_to_hospital(self, arguments):
+        for unsupported in (
+            "with_these_procedures",
+            "with_admission_method",
+            "with_source_of_admission",
+            "with_discharge_destination",
+            "with_patient_classification",
+            "with_admission_treatment_function_code",
+            "with_administrative_category",
+        ):
+            if arguments.get(unsupported):
+                raise NotImplementedError(f"{unsupported} is not supported")
+        mask = np.ones(len(self.store.column("apcs", "patient_id")), dtype=bool)
+        if arguments.get("with_these_diagnoses") is not None:
+            mask &= self.diagnosis_mask("apcs", "diagnoses", arguments["with_these_diagnoses"])
+        if arguments.get("with_these_primary_diagnoses") is not None:
+            mask &= self.diagnosis_mask("apcs", "primary_diagnosis", arguments["with_these_primary_diagnoses"])
+        return "apcs", mask, None
+
+    def select_with_these_codes_on_death_certificate(self, arguments):
+        column = "underlying_cause" if arguments.get("match_only_underlying_cause") else "causes"
+        return "ons_deaths", self.diagnosis_mask("ons_deaths", column, arguments["codelist"]), None
+
+    def select_died_from_any_cause(self, arguments):
+        return "ons_deaths", np.ones(len(self.store.column("ons_deaths", "patient_id")), dtype=bool), None
+
+    def select_with_test_result_in_sgss(self, arguments):
+        mask = np.ones(len(self.store.column("sgss", "patient_id")), dtype=bool)
+        if arguments.get("pathogen"):
+            mask &= np.asarray(self.store.column("sgss", "pathogen")) == arguments["pathogen"]
+        if arguments.get("test_result", "any") != "any":
+            mask &= np.asarray(self.store.column("sgss", "result")) == arguments["test_result"]
+        if arguments.get("restrict_to_earliest_specimen_date", True):
+            rows, known = self.event_rows("sgss")
+            earliest = windowed_matches(rows, None, mask & known, None, None, self.size).first
+            mask = np.zeros_like(mask)
+            mask[earliest[earliest != no_match]] = True
+        return "sgss", mask, None
+
+    def select_with_tpp_vaccination_record(self, arguments):
+        if arguments.get("procedure_codes"):
+            raise NotImplementedError("procedure_codes is not supported")
+        mask = np.ones(len(self.store.column("vaccinations", "patient_id")), dtype=bool)
+        if arguments.get("target_disease_matches"):
+            mask &= np.asarray(self.store.column("vaccinations", "target_disease")) == arguments["target_disease_matches"]
+        if arguments.get("product_name_matches"):
+            mask &= np.asarray(self.store.column("vaccinations", "product_name")) == arguments["product_name_matches"]
+        return "vaccinations", mask, None
+
+    def select_with_gp_consultations(self, arguments):
+        return "gp_consultations", np.ones(len(self.store.column("gp_consultations", "patient_id")), dtype=bool), None
+
+    def select_most_recent_bmi(self, arguments):
+        table = "clinical_events"
+        mask = np.asarray(self.store.column(table, "code")) == bmi_code
+        mask &= np.asarray(self.store.column(table, "numeric_value")) > 0
+        rows, _ = self.event_rows(table)
+        date_of_birth = np.asarray(self.store.column("patients", "date_of_birth"))[rows]
+        age = years_between(
+            np.where(date_of_birth == missing_date, 0, date_of_birth),
+            np.asarray(self.store.column(table, "date")),
+        )
+        mask &= (date_of_birth != missing_date) & (age >= (arguments.get("minimum_age_at_measurement") or 0))
+        return table, mask, None
+
+    # Other queries -------------------------------------------------------------
+
+    def query_all(self, name, arguments):
+        return np.ones(self.size, dtype=np.int64), "int"
+
+    def query_with_death_recorded_in_primary_care(self, name, arguments):
+        death_dates = np.asarray(self.store.column("patients", "primary_care_death_date"))
+        low, high = self.resolve_window(arguments)
+        present = (death_dates != missing_date) & (death_dates >= low) & (death_dates <= high)
+        if (arguments.get("returning") or "binary_flag") == "binary_flag":
+            return present.astype(np.int64), "int"
+        return np.where(present, death_dates, missing_date).astype(np.int32), "date"
+
+    def query_with_ethnicity_from_sus(self, name, arguments):
+        rows, known = self.event_rows("sus_ethnicity")
+        groups = np.asarray(self.store.column("sus_ethnicity", "group_6"))
+        present = known & (groups != "")
+        values = np.full(self.size, "", dtype=object)
+        if not present.any():
+            return values, "str"
+        # most frequently recorded group per patient, lowest group on ties
+        pairs, counts = np.unique(
+            np.rec.fromarrays([rows[present], groups[present]]), return_counts=True
+        )
+        order = np.lexsort((pairs.f1, -counts, pairs.f0))
+        first = np.unique(pairs.f0[order], return_index=True)[1]
+        values[pairs.f0[order][first]] = pairs.f1[order][first]
+        return values, "str"
+
+    def query_sex(self, name, arguments):
+        return np.asarray(self.store.column("patients", "sex")).astype(object), "str"
+
+    def query_date_of_birth(self, name, arguments):
+        return np.asarray(self.store.column("patients", "date_of_birth")), "date"
+
+    def query_age_as_of(self, name, arguments):
+        reference = np.broadcast_to(self.resolve_date(arguments["reference_date"]), (self.size,))
+        date_of_birth = np.asarray(self.store.column("patients", "date_of_birth"))
+        present = (date_of_birth != missing_date) & (reference != missing_date)
+        ages = years_between(np.where(present, date_of_birth, 0), np.where(present, reference, 0))
+        return np.where(present, ages, 0).astype(np.int64), "int"
+
+    def active_rows(self, table, reference_date, date_columns=("start_date", "end_date")):
+        """
+        mask of rows of a table (registrations, addresses) active on a date
+        """
+        rows, known = self.event_rows(table)
+        start = np.asarray(self.store.column(table, date_columns[0]))
+        end = np.asarray(self.store.column(table, date_columns[1]))
+        end = np.where(end == missing_date, maximum_date, end)
+        reference = np.broadcast_to(self.resolve_date(reference_date), (self.size,))[rows]
+        return known & (reference != missing_date) & (start <= reference) & (end >= reference)
+
+    def latest_active_value(self, table, reference_date, column, empty):
+        """
+        value of a column from the most recently started row active on a date
+        """
+        rows, _ = self.event_rows(table)
+        active = self.active_rows(table, reference_date)
+        matches = windowed_matches(rows, None, active, None, None, self.size)
+        return matches.values(self.store.column(table, column), empty, last=True)
+
+    def query_registered_as_of(self, name, arguments):
+        rows, _ = self.event_rows("registrations")
+        active = self.active_rows("registrations", arguments["reference_date"])
+        return (np.bincount(rows[active], minlength=self.size) > 0).astype(np.int64), "int"
+
+    def query_registered_with_one_practice_between(self, name, arguments):
+        rows, known = self.event_rows("registrations")
+        start = np.asarray(self.store.column("registrations", "start_date"))
+        end = np.asarray(self.store.column("registrations", "end_date"))
+        end = np.where(end == missing_date, maximum_date, end)
+        window_start = np.broadcast_to(self.resolve_date(arguments["start_date"]), (self.size,))[rows]
+        window_end = np.broadcast_to(self.resolve_date(arguments["end_date"]), (self.size,))[rows]
+        covering = known & (window_start != missing_date) & (start <= window_start) & (end >= window_end)
+        return (np.bincount(rows[covering], minlength=self.size) > 0).astype(np.int64), "int"
+
+    def query_date_deregistered_from_all_supported_practices(self, name, arguments):
+        rows, known = self.event_rows("registrations")
+        end = np.asarray(self.store.column("registrations", "end_date"))
+        ongoing = np.bincount(rows[known & (end == missing_date)], minlength=self.size) > 0
+        last_end = np.full(self.size, missing_date, dtype=np.int32)
+        np.maximum.at(last_end, rows[known], end[known])
+        low, high = self.resolve_window(arguments)
+        deregistered = ~ongoing & (last_end != missing_date) & (last_end >= low) & (last_end <= high)
+        return np.where(deregistered, last_end, missing_date).astype(np.int32), "date"
+
+    def query_registered_practice_as_of(self, name, arguments):
+        returning = arguments.get("returning")
+        if returning != "nuts1_region_name":
+            raise NotImplementedError(f"returning={returning!r} is not supported")
+        return self.latest_active_value("registrations", arguments["date"], "nuts1_region_name", ""), "str"
+
+    def query_address_as_of(self, name, arguments):
+        returning = arguments.get("returning")
+        if returning != "index_of_multiple_deprivation":
+            raise NotImplementedError(f"returning={returning!r} is not supported")
+        values = self.latest_active_value("addresses", arguments["date"], "index_of_multiple_deprivation", 0)
+        if arguments.get("round_to_nearest"):
+            nearest = arguments["round_to_nearest"]
+            values = (np.floor(values / nearest + 0.5) * nearest).astype(np.int64)
+        return values, "int"
+
+    def query_care_home_status_as_of(self, name, arguments):
+        reference_date = arguments["date"]
+        columns = {
+            "IsPotentialCareHome": self.latest_active_value("addresses", reference_date, "is_potential_care_home", 0),
+            "LocationRequiresNursing": self.latest_active_value("addresses", reference_date, "location_requires_nursing", ""),
+            "LocationDoesNotRequireNursing": self.latest_active_value("addresses", reference_date, "location_does_not_require_nursing", ""),
+        }
+        kinds = {"IsPotentialCareHome": "int", "LocationRequiresNursing": "str", "LocationDoesNotRequireNursing": "str"}
+        categories = arguments.get("categorised_as") or {1: "IsPotentialCareHome", 0: "DEFAULT"}
+        return evaluate_decision_table(categories, columns, kinds, self.size), "str"
+
+    def query_with_healthcare_worker_flag_on_covid_vaccine_record(self, name, arguments):
+        return np.asarray(self.store.column("patients", "healthcare_worker")).astype(np.int64), "int"
+
+    def query_with_value_from_file(self, name, arguments):
+        returning_type = arguments.get("returning_type")
+        values = load_value_file(arguments["f_path"]).aligned_column(
+            arguments["returning"], self.patient_ids, returning_type
+        )
+        return values, returning_type if returning_type in ("date", "int", "float") else "str"
+
+    def query_fixed_value(self, name, arguments):
+        kind = column_type_kinds[arguments["column_type"]]
+        return category_values(np.full(self.size, str(arguments["value"]), dtype=object), kind), kind
+
+    def query_value_from(self, name, arguments):
+        returning = arguments.get("returning")
+        if returning != "date":
+            raise NotImplementedError(f"returning={returning!r} is not supported")
+        return self.match_dates[arguments["source"]], "date"
+
+    def query_aggregate_of(self, name, arguments):
+        """
+        minimum (MIN) or maximum (MAX) of some columns, ignoring their empty
+        values (the default if all are empty)
+        """
+        names = arguments["column_names"]
+        kind = self.kinds[names[0]]
+        if kind == "str":
+            raise NotImplementedError("aggregate_of() string columns is not supported")
+        stacked = np.stack([self.columns[column] for column in names])
+        present = stacked != empty_values[kind]
+        limits = np.iinfo(stacked.dtype) if np.issubdtype(stacked.dtype, np.integer) else np.finfo(stacked.dtype)
+        if arguments["aggregate_function"] == "MIN":
+            values = np.where(present, stacked, limits.max).min(axis=0)
+        else:
+            values = np.where(present, stacked, limits.min).max(axis=0)
+        return np.where(present.any(axis=0), values, empty_values[kind]).astype(stacked.dtype), kind
+
+    def query_categorised_as(self, name, arguments):
+        categories = arguments["category_definitions"]
+        kind = column_type_kinds[arguments["column_type"]]
+        expression = satisfying_expression(categories)
+        if expression is not None:
+            return evaluate(expression, self.columns, self.kinds, self.size).astype(np.int64), "int"
+        n_groups = ethnicity_dictionary_groups(categories)
+        ntiles = deprivation_dictionary_ntiles(categories)
+        if n_groups:
+            values = resolve_ethnicity(n_groups, self.columns, self.kinds, self.size)
+        elif ntiles:
+            imd = self.columns["index_of_multiple_deprivation"]
+            values = bucket_by_cutpoints(imd, deprivation_ntile_cutpoints(ntiles))
+        else:
+            values = evaluate_decision_table(categories, self.columns, self.kinds, self.size)
+        return category_values(values, kind), kind
+
+    # Studies -----------------------------------------------------------------
+
+    def evaluate_variable(self, name, query_type, arguments):
+        """
+        evaluate one variable, once the variables it depends on have been
+        evaluated
+        """
+        if self.event_query(query_type):
+            values, kind = self.query_events(name, query_type, arguments)
+        else:
+            query = getattr(self, f"query_{query_type}", None)
+            if query is None:
+                raise NotImplementedError(f"patients.{query_type}() is not supported by the local engine")
+            values, kind = query(name, arguments)
+        self.store_variable(name, arguments, values, kind)
+
+    def store_variable(self, name, arguments, values, kind):
+        """
+        keep the values of an evaluated variable
+        """
+        self.columns[name] = values
+        self.kinds[name] = kind
+        # aggregate_of() takes the date format of its first column
+        columns = arguments.get("column_names")
+        self.date_formats[name] = arguments.get("date_format") or (
+            self.date_formats[columns[0]] if columns else "YYYY-MM-DD"
+        )
+        if arguments.get("hidden"):
+            self.hidden.add(name)
+
+    def evaluate_variables(self, variables, workers=1):
+        """
+        evaluate a study's covariate_definitions (a flat {name: (query_type,
+        arguments)} dictionary, see variable_definitions.py), in order; with
+        more than one worker, the variables are evaluated concurrently
+        level by level of their dependency graph
+        """
+        self.register_icd10_codelists(variables)
+        self.intern_codelists(variables)
+        self.plan_event_queries(variables)
+        if self.drop_temporary:
+            self.dropped |= temporary_variables(variables, required_temporary_prefixes)
+        if self.projection:
+            self.skipped |= unneeded_variables(variables, self.projection)
+        if workers <= 1:
+            for name, (query_type, arguments) in variables.items():
+                if name not in self.skipped:
+                    self.evaluate_variable(name, query_type, arguments)
+            return self.columns
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for level in topological_levels(dependency_graph(variables)):
+                futures = [
+                    executor.submit(self.evaluate_variable, name, *variables[name])
+                    for name in level
+                    if name not in self.skipped
+                ]
+                for future in futures:
+                    future.result()
+        # keep the columns in the order a sequential evaluation gives them
+        self.columns = {name: self.columns[name] for name in variables if name in self.columns}
+        return self.columns
+
+    def evaluate_study(self, study, workers=1):
+        """
+        evaluate a StudyDefinition; the written columns of the patients in
+        its population are then given by output_columns() or
+        typed_output_columns()
+        """
+        if self.index_date is None:
+            self.index_date = getattr(study, "index_date", None)
+        self.evaluate_variables(study.covariate_definitions, workers=workers)
+
+    def written_columns(self):
+        """
+        the population (as a mask) and the names of the written columns
+        """
+        population = self.columns.get("population", np.ones(self.size, dtype=np.int64)).astype(bool)
+        names = [
+            name
+            for name in self.columns
+            if not (name in self.hidden or name in not_written or name in self.dropped or name in self.projection)
+        ]
+        return population, names
+
+    def output_columns(self):
+        """
+        the written columns of the patients in the population, formatted as
+        cohortextractor writes them
+        """
+        population, names = self.written_columns()
+        output = {"patient_id": self.patient_ids[population].astype(str).astype(object)}
+        for name in names:
+            output[name] = self.format_column(name, self.columns[name][population])
+        return output
+
+    def typed_output_columns(self):
+        """
+        the written columns of the patients in the population as evaluated,
+        as (kind, values, date format): int32 days (missing_date if missing)
+        for dates, numbers, or strings ('' if missing)
+        """
+        population, names = self.written_columns()
+        output = {"patient_id": ("int", self.patient_ids[population], None)}
+        for name in names:
+            output[name] = (self.kinds[name], self.columns[name][population], self.date_formats.get(name))
+        return output
+
+    def format_column(self, name, values):
+        kind = self.kinds[name]
+        if kind == "date":
+            return days_to_dates(values, self.date_formats[name])
+        return values.astype(str).astype(object)
+
+
+def write_csv(columns, path):
+    """
+    write formatted columns to a CSV file, gzipped if the path ends .gz
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    names = list(columns)
+    with opener(path, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(columns[name] for name in names)))
+
+
+def write_cohort(engine, path, study_definition, variables):
+    """
+    write an evaluated cohort to a file (Parquet, from the typed columns, if
+    the path ends .parquet, CSV otherwise) with its schema
+    """
+    if path.endswith(".parquet"):
+        columns = engine.typed_output_columns()
+        write_parquet(columns, cohort_schema(variables, list(columns)), path)
+    else:
+        columns = engine.output_columns()
+        write_csv(columns, path)
+    write_schema(schema_path(path), study_definition, variables, list(columns))
+
+
+def main(study_definition, store_directory, output_path, workers=None, drop_temporary=False, active_analyses=False):
+    study = importlib.import_module(study_definition).study
+    projection = None
+    if active_analyses:
+        cohort = study_definition.replace("study_definition_", "")
+        projection = projected_out_columns(study.covariate_definitions, read_active_analyses(), cohort)
+    engine = LocalEngine(EventStore(store_directory), drop_temporary=drop_temporary, projection=projection)
+    workers = int(workers) if workers else os.cpu_count() or 1
+    engine.evaluate_study(study, workers=workers)
+    write_cohort(engine, output_path, study_definition, study.covariate_definitions)
+
+
+if __name__ == "__main__":
+    main(
+        *[argument for argument in sys.argv[1:] if not argument.startswith("--")],
+        drop_temporary="--drop-temporary" in sys.argv,
+        active_analyses="--active-analyses" in sys.argv,
+    )
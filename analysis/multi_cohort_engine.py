@@ -0,0 +1,232 @@
+# Multi-cohort local extraction
+#
+# study_definition_vax.py, study_definition_unvax_extf.py and
+# study_definition_prevax_extf.py all call generate_common_variables(), so
+# most of their variables select the same events and differ only in the
+# window of each patient (index_date_cohort and the end dates come from a
+# different column of index_dates.csv.gz in each cohort). Here the cohorts
+# are evaluated together: each shared event variable selects its events
+# once, and every selected event is compared against the windows of all the
+# cohorts in the same pass (see windowed_matches_many()). Where cohorts
+# differ only in their end dates, as prevax and prevax_extf or unvax and
+# unvax_extf do, first matches are found once in the longest window and
+# clipped to each cohort's end date. Static variables, such as the JCVI
+# group variables, which only depend on fixed dates, are evaluated once and
+# their values joined into every cohort that defines them identically.
+# With --parquet, cohorts are written as input_<cohort>.parquet rather than
+# input_<cohort>.csv.gz.
+#
+# Usage:
+#   python analysis/multi_cohort_engine.py <store directory> <output directory> <study definition> ... [--drop-temporary] [--active-analyses] [--parquet]
+# e.g.
+#   python analysis/multi_cohort_engine.py local_store output study_definition_vax study_definition_unvax_extf study_definition_prevax_extf
+
+import importlib
+import os
+import sys
+
+import numpy as np
+
+from column_projection import projected_out_columns, read_active_analyses
+from event_store import EventStore
+from local_engine import LocalEngine, required_temporary_prefixes, write_cohort
+from variable_definitions import (
+    classify_variables,
+    definition_key,
+    dependent_definition_keys,
+    temporary_variables,
+    unneeded_variables,
+)
+from window_kernels import windowed_matches_many, windows_by_start
+
+
+class MultiCohortEngine:
+    """
+    evaluates several study definitions against one EventStore, sharing the
+    scans of the event tables between the cohorts
+    """
+
+    def __init__(self, store, studies, drop_temporary=False, projections=None):
+        self.store = store
+        self.studies = studies
+        self.engines = {}
+        shared = None
+        for name, study in studies.items():
+            engine = LocalEngine(
+                store,
+                index_date=getattr(study, "index_date", None),
+                drop_temporary=drop_temporary,
+                projection=(projections or {}).get(name),
+            )
+            if shared is None:
+                shared = engine
+            else:
+                # code and diagnosis matching results are the same for every cohort
+                engine.event_rows_cache = shared.event_rows_cache
+                engine.code_ids_cache = shared.code_ids_cache
+                engine.codelist_ids_cache = shared.codelist_ids_cache
+                engine.icd10_codelists = shared.icd10_codelists
+                engine.icd10_masks = shared.icd10_masks
+            self.engines[name] = engine
+        self.evaluated = {name: set() for name in studies}
+        self.shared_scans = 0
+        self.separate_scans = 0
+        self.clipped_scans = 0
+        self.static_variables = 0
+        self.classes = {name: classify_variables(study.covariate_definitions) for name, study in studies.items()}
+        self.dependent_keys = {
+            name: dependent_definition_keys(study.covariate_definitions) for name, study in studies.items()
+        }
+
+    def evaluate_shared(self, names, variable, query_type, arguments):
+        """
+        evaluate a variable defined identically in the cohorts `names`
+        """
+        engines = [self.engines[name] for name in names]
+        lead = engines[0]
+        if len(names) > 1 and self.is_static(names, variable):
+            self.join_static(names, variable, query_type, arguments)
+            return
+        if lead.event_query(query_type):
+            table, mask, category_of, summary_arguments = lead.select_events(query_type, arguments)
+            rows, known = lead.event_rows(table)
+            dates = np.asarray(self.store.column(table, "date"))
+            windows = [engine.resolve_window(summary_arguments) for engine in engines]
+            # first matches in a shorter window can be clipped from those in
+            # a longer one with the same start, e.g. prevax from prevax_extf
+            first_only = bool(summary_arguments.get("find_first_match_in_period")) and (
+                summary_arguments.get("returning") != "number_of_matches_in_period"
+            )
+            all_matches = windowed_matches_many(
+                rows, dates, mask & known, windows, lead.size, first_only=first_only
+            )
+            if first_only:
+                self.clipped_scans += sum(len(group) > 1 for group in windows_by_start(windows))
+            for engine, matches in zip(engines, all_matches):
+                values, kind = engine.summarise_events(variable, table, matches, summary_arguments, category_of)
+                engine.store_variable(variable, arguments, values, kind)
+            if len(engines) > 1:
+                self.shared_scans += 1
+            else:
+                self.separate_scans += 1
+        else:
+            for engine in engines:
+                values, kind = getattr(engine, f"query_{query_type}")(variable, arguments)
+                engine.store_variable(variable, arguments, values, kind)
+        for name in names:
+            self.evaluated[name].add(variable)
+
+    def is_static(self, names, variable):
+        """
+        whether a variable is static, with the same definitions (and the
+        same definitions of everything it depends on), in the cohorts `names`
+        """
+        keys = {repr(self.dependent_keys[name].get(variable)) for name in names}
+        return len(keys) == 1 and all(self.classes[name].get(variable) == "static" for name in names)
+
+    def join_static(self, names, variable, query_type, arguments):
+        """
+        evaluate a static variable for the first of the cohorts `names`, and
+        join its values into the others
+        """
+        lead, *others = (self.engines[name] for name in names)
+        lead.evaluate_variable(variable, query_type, arguments)
+        for engine in others:
+            engine.columns[variable] = lead.columns[variable]
+            engine.kinds[variable] = lead.kinds[variable]
+            engine.date_formats[variable] = lead.date_formats[variable]
+            if variable in lead.match_dates:
+                engine.match_dates[variable] = lead.match_dates[variable]
+            if variable in lead.hidden:
+                engine.hidden.add(variable)
+        for name in names:
+            self.evaluated[name].add(variable)
+        self.static_variables += 1
+
+    def evaluate_separately(self, name, variable, query_type, arguments):
+        self.evaluate_shared([name], variable, query_type, arguments)
+
+    def evaluate(self):
+        """
+        evaluate every cohort, walking the variables of the first cohort in
+        order; before a variable is evaluated jointly, each other cohort first
+        catches up on its own preceding variables, so that every cohort still
+        evaluates its variables in its own order; returns each cohort's engine
+        """
+        definitions = {name: study.covariate_definitions for name, study in self.studies.items()}
+        order = {name: list(variables) for name, variables in definitions.items()}
+        positions = {name: 0 for name in definitions}
+        for engine, variables in zip(self.engines.values(), definitions.values()):
+            engine.register_icd10_codelists(variables)
+            engine.intern_codelists(variables)
+            engine.plan_event_queries(variables)
+            if engine.drop_temporary:
+                engine.dropped |= temporary_variables(variables, required_temporary_prefixes)
+            if engine.projection:
+                engine.skipped |= unneeded_variables(variables, engine.projection)
+
+        def catch_up(name, until=None):
+            while positions[name] < len(order[name]) and order[name][positions[name]] != until:
+                variable = order[name][positions[name]]
+                if variable not in self.evaluated[name] and variable not in self.engines[name].skipped:
+                    self.evaluate_separately(name, variable, *definitions[name][variable])
+                positions[name] += 1
+
+        lead = next(iter(definitions))
+        for variable, (query_type, arguments) in definitions[lead].items():
+            key = definition_key(query_type, arguments)
+            sharing = [] if variable in self.engines[lead].skipped else [lead]
+            for name, variables in definitions.items():
+                if name == lead or variable not in variables or variable in self.evaluated[name]:
+                    continue
+                catch_up(name, until=variable)
+                if variable in self.engines[name].skipped:
+                    continue
+                if definition_key(*variables[variable]) == key:
+                    sharing.append(name)
+                else:
+                    self.evaluate_separately(name, variable, *variables[variable])
+            if sharing:
+                self.evaluate_shared(sharing, variable, *definitions[sharing[0]][variable])
+        for name in definitions:
+            catch_up(name)
+        return self.engines
+
+
+def main(
+    store_directory,
+    output_directory,
+    *study_definitions,
+    drop_temporary=False,
+    active_analyses=False,
+    output_format="csv.gz",
+):
+    studies = {name: importlib.import_module(name).study for name in study_definitions}
+    projections = None
+    if active_analyses:
+        analyses = read_active_analyses()
+        projections = {
+            name: projected_out_columns(study.covariate_definitions, analyses, name.replace("study_definition_", ""))
+            for name, study in studies.items()
+        }
+    engine = MultiCohortEngine(
+        EventStore(store_directory), studies, drop_temporary=drop_temporary, projections=projections
+    )
+    for name, cohort_engine in engine.evaluate().items():
+        cohort = name.replace("study_definition_", "")
+        path = os.path.join(output_directory, f"input_{cohort}.{output_format}")
+        write_cohort(cohort_engine, path, name, studies[name].covariate_definitions)
+    print(
+        f"{engine.shared_scans} event variables shared between cohorts "
+        f"({engine.clipped_scans} window groups clipped), {engine.separate_scans} evaluated separately, "
+        f"{engine.static_variables} static variables evaluated once"
+    )
+
+
+if __name__ == "__main__":
+    main(
+        *[argument for argument in sys.argv[1:] if not argument.startswith("--")],
+        drop_temporary="--drop-temporary" in sys.argv,
+        active_analyses="--active-analyses" in sys.argv,
+        output_format="parquet" if "--parquet" in sys.argv else "csv.gz",
+    )
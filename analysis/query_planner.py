@@ -0,0 +1,146 @@
+# Query-fusion planner
+#
+# generate_common_variables() defines dozens of event queries that differ only
+# in their codelist, e.g. the covariate flags
+#   patients.with_these_clinical_events(<codelist>, returning="binary_flag",
+#                                       on_or_before="index_date_cohort - 1 day")
+# The planner groups such variables by everything except the codelist, so
+# each group can be answered by a single scan of the events table with a
+# tagged union codelist, and the matching events fanned back out to the
+# individual variables. The local engine scans each group's events once
+# (see LocalEngine.fused_masks()).
+
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+
+from code_dictionary import code_dictionary, codes_in
+
+# Queries over an events table that are selected by a single codelist
+fusible_query_types = {
+    "with_these_clinical_events": "clinical_events",
+    "with_these_medications": "medications",
+}
+
+# Arguments that do not change which events are matched or how they are
+# summarised, so may differ within a fused query
+per_variable_arguments = {"codelist", "return_expectations", "date_format", "hidden"}
+
+
+@dataclass
+class FusedQuery:
+    """
+    a group of variables answered by one scan of an events table
+    """
+
+    source: str
+    query_type: str
+    system: str
+    arguments: dict
+    key: tuple = None
+    codelists: dict = field(default_factory=dict)
+
+    @property
+    def variables(self):
+        return list(self.codelists)
+
+    def tagged_codes(self):
+        """
+        return the union codelist as {code: (variable names, ...)}
+        """
+        tags = {}
+        for name, codelist in self.codelists.items():
+            codes = (code for code, _ in codelist) if codelist.has_categories else codelist
+            for code in codes:
+                tags.setdefault(code, []).append(name)
+        return {code: tuple(names) for code, names in tags.items()}
+
+    def union_codes(self):
+        """
+        all codes that any variable in the group matches
+        """
+        return list(self.tagged_codes())
+
+    @cached_property
+    def codelist_ids(self):
+        """
+        sorted code ids of each variable's codelist, encoded on first use
+        (once the plan is complete)
+        """
+        dictionary = code_dictionary(self.system)
+        return {
+            name: dictionary.encode([code for code, _ in codelist] if codelist.has_categories else codelist)
+            for name, codelist in self.codelists.items()
+        }
+
+    def fan_out(self, event_ids):
+        """
+        given the code ids of the events returned by the fused scan, return a
+        boolean mask per variable selecting the events that belong to it
+        """
+        return {name: codes_in(event_ids, ids) for name, ids in self.codelist_ids.items()}
+
+
+def fusion_key(query_type, arguments):
+    """
+    key on which variables can share a scan: the query type, the coding
+    system and every argument that affects matching or summarising
+    """
+    shared = []
+    for argument, value in sorted(arguments.items()):
+        if argument in per_variable_arguments:
+            continue
+        if isinstance(value, list):
+            value = tuple(value)
+        shared.append((argument, repr(value)))
+    return (query_type, arguments["codelist"].system, tuple(shared))
+
+
+def plan_fused_queries(variables):
+    """
+    group the fusible event queries in a study's variables by fusion key,
+    returning one FusedQuery per group in the order the groups first appear;
+    groups of a single variable are included so that the plan covers every
+    event query
+    """
+    plan = {}
+    for name, (query_type, arguments) in variables.items():
+        if query_type not in fusible_query_types:
+            continue
+        key = fusion_key(query_type, arguments)
+        if key not in plan:
+            plan[key] = FusedQuery(
+                source=fusible_query_types[query_type],
+                query_type=query_type,
+                system=arguments["codelist"].system,
+                key=key,
+                arguments={
+                    argument: value
+                    for argument, value in arguments.items()
+                    if argument not in per_variable_arguments
+                },
+            )
+        plan[key].codelists[name] = arguments["codelist"]
+    return list(plan.values())
+
+
+def summarise_plan(plan):
+    """
+    number of event queries before and after fusion, per events table
+    """
+    summary = {}
+    for query in plan:
+        counts = summary.setdefault(query.source, {"variables": 0, "scans": 0})
+        counts["variables"] += len(query.codelists)
+        counts["scans"] += 1
+    return summary
+
+
+def fused_event_mask(query, event_ids):
+    """
+    boolean mask of the events (given the code ids of their codes in the
+    query's coding system) matched by any variable of a fused query
+    """
+    union_ids = code_dictionary(query.system).encode(query.union_codes())
+    return codes_in(np.asarray(event_ids), union_ids)
@@ -16,6 +16,18 @@ def generate_ethnicity_dictionary(n_groups: int) -> dict:
     return eth_dict
 
 
+def ethnicity_dictionary_groups(category_definitions: dict) -> int:
+    """
+    number of groups if category_definitions is the dictionary built by
+    generate_ethnicity_dictionary(), else 0; lets the local engine resolve
+    it directly rather than clause by clause
+    """
+    n_groups = len(category_definitions) - 1
+    if n_groups > 0 and category_definitions == generate_ethnicity_dictionary(n_groups):
+        return n_groups
+    return 0
+
+
 def generate_deprivation_ntile_dictionary(ntiles: int) -> dict:
     """
     create dictionary of n:logical defition of ntiles of index of multiple deprivation
@@ -31,6 +43,26 @@ def generate_deprivation_ntile_dictionary(ntiles: int) -> dict:
     return dep_dict
 
 
+def deprivation_ntile_cutpoints(ntiles: int) -> list:
+    """
+    lower bound of each ntile in generate_deprivation_ntile_dictionary(ntiles),
+    with the integer division of 32844*n/ntiles done once: ntile n covers
+    cutpoints[n-1] <= index_of_multiple_deprivation < cutpoints[n]
+    """
+    return [1] + [32844 * n // ntiles for n in range(1, ntiles)]
+
+
+def deprivation_dictionary_ntiles(category_definitions: dict) -> int:
+    """
+    number of ntiles if category_definitions is the dictionary built by
+    generate_deprivation_ntile_dictionary(), else 0
+    """
+    ntiles = len(category_definitions) - 1
+    if ntiles > 0 and category_definitions == generate_deprivation_ntile_dictionary(ntiles):
+        return ntiles
+    return 0
+
+
 def generate_universal_expectations(n_categories: int, zero_category=True) -> dict:
     """
     generate expectations statement for categorical variable of n classes
@@ -14,9 +14,6 @@ from cohortextractor import (
   combine_codelists,
 )
 
-## Codelists from codelist.py (which pulls them from the codelist folder)
-from codelists import *
-
 ## Datetime functions
 from datetime import date
 
@@ -23,9 +23,6 @@ from grouping_variables import (
     jcvi_variables,
 )
 
-## Codelists from codelist.py (which pulls them from the codelist folder)
-from codelists import *
-
 ## Datetime functions
 from datetime import date
 
@@ -0,0 +1,214 @@
+# Synthetic event store for local extraction
+#
+# Writes a small, reproducible event store (see event_store.py) of
+# synthetic patients whose events are drawn from this project's codelists,
+# together with the index_dates.csv.gz that prelim.R would write for them
+# (in the store directory, so that output/index_dates.csv.gz is left alone),
+# so that the local engines can be run and checked without access to patient
+# data (see check_cohort_equivalence.py). The index dates are taken from
+# output/study_dates.json, so run from the project root after the
+# generate_study_dates action (metadates.R), which also writes the JCVI group
+# and eligibility date files the study definitions read:
+#   python analysis/synthetic_store.py <store directory> [<patients>] [--seed <n>]
+
+import csv
+import gzip
+import json
+import os
+import sys
+
+import numpy as np
+
+import codelists
+from event_store import EventStore, date_to_days, missing_date
+
+default_patients = 2_000
+
+# Dates of the synthetic events
+first_date, last_date = "2015-01-01", "2023-01-01"
+
+# Latest end date of the extended follow-up cohorts (prevax_extf, unvax_extf)
+extended_end = "2022-12-31"
+
+vaccine_products = [
+    "COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)",
+    "COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)",
+]
+
+# SNOMED code of the BMI observations the study definitions read
+bmi_code = "60621009"
+
+# File of the store directory holding the synthetic index dates
+index_dates_file = "index_dates.csv.gz"
+
+index_date_columns = [
+    "patient_id",
+    "index_prevax",
+    "end_prevax",
+    "end_prevax_extf",
+    "index_vax",
+    "end_vax",
+    "index_unvax",
+    "end_unvax",
+    "end_unvax_extf",
+    "cov_cat_sex",
+] + [f"vax_date_{product}_{dose}" for product in ["covid", "Pfizer", "AstraZeneca", "Moderna"] for dose in (1, 2, 3)]
+
+
+def codes_by_system():
+    """
+    the codes of every codelist in codelists.py, by coding system
+    """
+    codes = {}
+    for name in codelists.codelist_definitions:
+        codelist = codelists.load_codelist(name)
+        values = [code for code, _ in codelist] if codelist.has_categories else list(codelist)
+        codes.setdefault(codelist.system, set()).update(values)
+    return {system: sorted(values) for system, values in codes.items()}
+
+
+def format_date(days):
+    return str(np.datetime64("1970-01-01") + np.timedelta64(int(days), "D"))
+
+
+def write_store(store, patients, rng):
+    """
+    write every table of the store for `patients` patients, returning their
+    patient ids
+    """
+    size = patients
+    patient_ids = np.arange(1, size + 1) * 3
+    start, end = date_to_days(first_date), date_to_days(last_date)
+
+    def dates(n, earliest=start):
+        return rng.integers(earliest, end, n)
+
+    def sometimes(rate, values):
+        return np.where(rng.random(size) < rate, values, missing_date)
+
+    registered = np.full(size, date_to_days("2000-01-01"))
+    store.write_table("patients", dict(
+        patient_id=patient_ids,
+        sex=rng.choice(["M", "F"], size),
+        date_of_birth=rng.integers(date_to_days("1920-01-01"), date_to_days("2005-01-01"), size),
+        primary_care_death_date=sometimes(0.02, dates(size)),
+        healthcare_worker=(rng.random(size) < 0.01).astype(int),
+    ))
+    store.write_table("registrations", dict(
+        patient_id=patient_ids,
+        start_date=registered,
+        end_date=sometimes(0.05, dates(size)),
+        nuts1_region_name=rng.choice(["London", "East", "North West"], size),
+    ))
+    store.write_table("addresses", dict(
+        patient_id=patient_ids,
+        start_date=registered,
+        end_date=np.full(size, missing_date),
+        index_of_multiple_deprivation=rng.integers(1, 32844, size),
+        is_potential_care_home=(rng.random(size) < 0.02).astype(int),
+        location_requires_nursing=rng.choice(["Y", "N"], size),
+        location_does_not_require_nursing=rng.choice(["Y", "N"], size),
+    ))
+
+    codes = codes_by_system()
+    snomed, ctv3, bmi = 20 * size, 10 * size, size
+    store.write_table("clinical_events", dict(
+        patient_id=rng.choice(patient_ids, snomed + ctv3 + bmi),
+        date=dates(snomed + ctv3 + bmi),
+        system=np.array(["snomed"] * snomed + ["ctv3"] * ctv3 + ["snomed"] * bmi),
+        code=np.concatenate([
+            rng.choice(codes["snomed"], snomed), rng.choice(codes["ctv3"], ctv3), np.full(bmi, bmi_code)
+        ]),
+        numeric_value=np.concatenate([rng.random(snomed) * 10, np.zeros(ctv3), rng.normal(27, 6, bmi)]),
+    ))
+    store.write_table("medications", dict(
+        patient_id=rng.choice(patient_ids, 5 * size),
+        date=dates(5 * size),
+        code=rng.choice(codes["snomed"], 5 * size),
+    ))
+
+    diagnoses = [",".join(rng.choice(codes["icd10"], 3)) for _ in range(size)]
+    store.write_table("apcs", dict(
+        patient_id=rng.choice(patient_ids, size),
+        date=dates(size),
+        primary_diagnosis=[diagnosis.split(",")[0] for diagnosis in diagnoses],
+        diagnoses=diagnoses,
+    ))
+    deaths = size // 20
+    causes = [",".join(rng.choice(codes["icd10"], 2)) for _ in range(deaths)]
+    store.write_table("ons_deaths", dict(
+        patient_id=rng.choice(patient_ids, deaths, replace=False),
+        date=dates(deaths, date_to_days("2020-01-01")),
+        underlying_cause=[cause.split(",")[0] for cause in causes],
+        causes=causes,
+    ))
+    store.write_table("sgss", dict(
+        patient_id=rng.choice(patient_ids, size),
+        date=dates(size, date_to_days("2020-03-01")),
+        pathogen=np.full(size, "SARS-CoV-2"),
+        result=rng.choice(["positive", "negative"], size),
+    ))
+    store.write_table("vaccinations", dict(
+        patient_id=rng.choice(patient_ids, 2 * size),
+        date=dates(2 * size, date_to_days("2020-12-08")),
+        target_disease=np.full(2 * size, "SARS-2 CORONAVIRUS"),
+        product_name=rng.choice(vaccine_products, 2 * size),
+    ))
+    store.write_table("sus_ethnicity", dict(
+        patient_id=rng.choice(patient_ids, size),
+        date=dates(size),
+        group_6=rng.choice(["1", "2", "3", "4", "5", ""], size),
+    ))
+    store.write_table("gp_consultations", dict(
+        patient_id=rng.choice(patient_ids, 5 * size),
+        date=dates(5 * size),
+    ))
+    return patient_ids
+
+
+def write_index_dates(patient_ids, rng, path):
+    """
+    write the cohort index and end dates and first vaccination dates of
+    each patient, with NA for missing as readr::write_csv writes it
+    """
+    with open("output/study_dates.json") as f:
+        study_dates = json.load(f)
+    start = date_to_days(study_dates["start_date"])
+    with gzip.open(path, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(index_date_columns)
+        for patient_id in patient_ids:
+            vaccinated = rng.random() < 0.7
+            vaccination = format_date(start + rng.integers(0, 200)) if vaccinated else "NA"
+            writer.writerow(
+                [
+                    patient_id,
+                    study_dates["pandemic_start"],
+                    study_dates["omicron_date"],
+                    extended_end,
+                    vaccination,
+                    study_dates["omicron_date"] if vaccinated else "NA",
+                    study_dates["delta_date"],
+                    study_dates["omicron_date"],
+                    extended_end,
+                    rng.choice(["M", "F"]),
+                    vaccination,
+                ]
+                + ["NA"] * 11
+            )
+
+
+def main(store_directory, patients=default_patients, seed=1):
+    rng = np.random.default_rng(seed)
+    patient_ids = write_store(EventStore(store_directory), patients, rng)
+    write_index_dates(patient_ids, rng, os.path.join(store_directory, index_dates_file))
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    seed = 1
+    if "--seed" in arguments:
+        position = arguments.index("--seed")
+        seed = int(arguments[position + 1])
+        del arguments[position : position + 2]
+    main(arguments[0], int(arguments[1]) if len(arguments) > 1 else default_patients, seed)
@@ -0,0 +1,219 @@
+# Shared loader for patients.with_value_from_file() columns
+#
+# The cohort study definitions read 15+ columns each from
+# output/index_dates.csv.gz (index and end dates, sex, vaccination dates).
+# Rather than decompressing and parsing the file once per variable, each file
+# is parsed once per process and every column is served from that table.
+#
+# prelim.R also writes output/index_dates.arrow, an uncompressed Arrow IPC
+# copy with dates as date32 (int32 days since 1970-01-01), patient_id as
+# int64 and sex as a dictionary. When pyarrow is installed and the copy is
+# at least as new as the CSV, it is memory-mapped instead, so only the
+# columns that are used are read and no dates are parsed. A copy can also be
+# made from the CSV with
+#   python analysis/value_files.py output/index_dates.csv.gz
+
+import csv
+import gzip
+import os
+import sys
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+from event_store import dates_to_days, missing_date, missing_values
+
+# Parsed files, keyed on path, modification time and size so that a file
+# rewritten by an earlier action is parsed again
+loaded_value_files = {}
+
+
+class ValueFile:
+    """
+    columns of a CSV file with a patient_id column, parsed once and typed on
+    demand
+    """
+
+    def __init__(self, path, patient_ids, raw_columns):
+        self.path = path
+        self.patient_ids = patient_ids
+        self.raw_columns = raw_columns
+        self.typed_columns = {}
+        self.alignments = {}
+
+    def column(self, name, returning_type=None):
+        """
+        one column converted to the type cohortextractor would return, with
+        the value used for missing entries
+        """
+        key = (name, returning_type)
+        if key not in self.typed_columns:
+            if name not in self.raw_columns:
+                raise KeyError(f"Column {name!r} not found in {self.path}")
+            values = self.raw_columns[name]
+            if returning_type == "date":
+                typed = (dates_to_days(values), missing_date)
+            elif returning_type == "int":
+                typed = (
+                    np.array([0 if value in missing_values else int(value) for value in values], dtype=np.int64),
+                    0,
+                )
+            elif returning_type == "float":
+                typed = (
+                    np.array(
+                        [0.0 if value in missing_values else float(value) for value in values], dtype=np.float64
+                    ),
+                    0.0,
+                )
+            else:
+                typed = (np.array(["" if value in missing_values else value for value in values], dtype=object), "")
+            self.typed_columns[key] = typed
+        return self.typed_columns[key]
+
+    def alignment(self, patient_ids):
+        """
+        positions in patient_ids (sorted) of the file's rows, and which of
+        the file's patients are in patient_ids at all
+        """
+        key = id(patient_ids)
+        cached = self.alignments.get(key)
+        if cached is None or cached[0] is not patient_ids:
+            positions = np.searchsorted(patient_ids, self.patient_ids)
+            found = positions < len(patient_ids)
+            found[found] = patient_ids[positions[found]] == self.patient_ids[found]
+            cached = self.alignments[key] = (patient_ids, positions[found], found)
+        return cached[1], cached[2]
+
+    def aligned_column(self, name, patient_ids, returning_type=None):
+        """
+        one column aligned with patient_ids, with the missing value for
+        patients not in the file
+        """
+        values, empty = self.column(name, returning_type)
+        positions, found = self.alignment(patient_ids)
+        aligned = np.full(len(patient_ids), empty, dtype=values.dtype)
+        aligned[positions] = values[found]
+        return aligned
+
+
+class ArrowValueFile(ValueFile):
+    """
+    ValueFile backed by a memory-mapped Arrow IPC file
+    """
+
+    def __init__(self, path, table):
+        patient_ids = table.column("patient_id").to_numpy().astype(np.int64, copy=False)
+        super().__init__(path, patient_ids, {})
+        self.table = table
+
+    def column(self, name, returning_type=None):
+        key = (name, returning_type)
+        if key not in self.typed_columns:
+            if name not in self.table.column_names:
+                raise KeyError(f"Column {name!r} not found in {self.path}")
+            values = self.table.column(name)
+            if pa.types.is_dictionary(values.type):
+                values = values.cast(values.type.value_type)
+            if returning_type == "date":
+                if pa.types.is_date32(values.type):
+                    days = values.cast(pa.int32()).fill_null(missing_date)
+                else:
+                    missing = pc.is_in(values, value_set=pa.array(missing_values))
+                    values = pc.if_else(missing, pa.scalar(None, values.type), values)
+                    days = pc.cast(pc.strptime(values, "%Y-%m-%d", "s"), pa.date32())
+                    days = days.cast(pa.int32()).fill_null(missing_date)
+                typed = (days.to_numpy().astype(np.int32), missing_date)
+            elif returning_type == "int":
+                typed = (values.fill_null(0).to_numpy().astype(np.int64), 0)
+            elif returning_type == "float":
+                typed = (values.fill_null(0).to_numpy().astype(np.float64), 0.0)
+            else:
+                typed = (np.array(values.cast(pa.string()).fill_null("").to_pylist(), dtype=object), "")
+            self.typed_columns[key] = typed
+        return self.typed_columns[key]
+
+
+def arrow_path(path):
+    """
+    path of the Arrow IPC copy of a CSV file
+    """
+    for extension in (".csv.gz", ".csv"):
+        if path.endswith(extension):
+            return path[: -len(extension)] + ".arrow"
+    return path + ".arrow"
+
+
+def read_arrow_value_file(path):
+    """
+    memory-map an Arrow IPC file into an ArrowValueFile
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return ArrowValueFile(path, table)
+
+
+def write_arrow_value_file(csv_path, path=None):
+    """
+    write the Arrow IPC copy of a CSV file, typing columns as prelim.R does:
+    *_date and index_*/end_* columns as date32, patient_id as int64 and
+    other text columns as dictionaries
+    """
+    path = path or arrow_path(csv_path)
+    value_file = read_value_file(csv_path)
+    arrays = {}
+    for name in value_file.raw_columns:
+        if name == "patient_id":
+            arrays[name] = pa.array(value_file.patient_ids, type=pa.int64())
+        elif "_date" in name or name.startswith(("index_", "end_")):
+            days = value_file.column(name, "date")[0]
+            arrays[name] = pa.array(days, mask=days == missing_date).cast(pa.date32())
+        else:
+            values = [None if value in missing_values else value for value in value_file.raw_columns[name]]
+            arrays[name] = pa.array(values, type=pa.string()).dictionary_encode()
+    table = pa.table(arrays)
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+def read_value_file(path):
+    """
+    parse a (gzipped) CSV file into a ValueFile
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = list(zip(*reader)) or [()] * len(header)
+    raw_columns = {name: list(values) for name, values in zip(header, columns)}
+    patient_ids = np.array([int(value) for value in raw_columns["patient_id"]], dtype=np.int64)
+    return ValueFile(path, patient_ids, raw_columns)
+
+
+def load_value_file(path):
+    """
+    the ValueFile for a path, parsed on first use
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in loaded_value_files:
+        binary_path = arrow_path(path)
+        if (
+            pa is not None
+            and os.path.exists(binary_path)
+            and os.stat(binary_path).st_mtime_ns >= stat.st_mtime_ns
+        ):
+            loaded_value_files[key] = read_arrow_value_file(binary_path)
+        else:
+            loaded_value_files[key] = read_value_file(path)
+    return loaded_value_files[key]
+
+
+if __name__ == "__main__":
+    write_arrow_value_file(*sys.argv[1:3])
@@ -0,0 +1,215 @@
+# Helpers for inspecting study definition variables
+#
+# Each `patients.*` call returns a (query_type, arguments) tuple, e.g.
+# ("with_these_clinical_events", {"codelist": ..., "returning": "date", ...}),
+# and StudyDefinition processes these into the flat `covariate_definitions`
+# dictionary the helpers below take:
+# - variables defined inside categorised_as()/satisfying() are moved in front
+#   of their parent and marked "hidden" (computed, but not written)
+# - satisfying() becomes categorised_as() with categories 1 and 0 (DEFAULT),
+#   minimum_of()/maximum_of() become aggregate_of() with an aggregate_function
+#   of MIN/MAX, and date_of() and include_date_of_match become value_from() of
+#   the source variable's date
+# - on_or_before/on_or_after become a `between` pair, with None for an open
+#   bound, and every variable is given its "column_type" (bool, int, float,
+#   str or date)
+
+import re
+
+from expressions import parse, referenced_columns
+
+# e.g. "index_date_cohort - 1 day", "2021-02-14", "vax_date_covid_1 + 1 day"
+date_expression_pattern = re.compile(
+    r"""
+    ^\s*(?P<reference>\d{4}-\d{2}-\d{2}|[A-Za-z_][A-Za-z0-9_]*)
+    \s*(?:(?P<sign>[+-])\s*(?P<number>\d+)\s*(?P<unit>days?|months?|years?))?\s*$
+    """,
+    re.VERBOSE,
+)
+
+# Arguments that hold date expressions
+date_arguments = ("between", "reference_date", "date", "start_date", "end_date")
+
+# Date references that are the same for every patient (besides literal dates)
+fixed_date_references = {"today"}
+
+
+def hidden_variables(variables):
+    """
+    names of the variables that are computed but not written
+    """
+    return {name for name, (_, arguments) in variables.items() if arguments.get("hidden")}
+
+
+def definition_key(query_type, arguments):
+    """
+    hashable key of a variable's definition, equal for variables that select
+    the same values; codelists are compared by their codes (StudyDefinition
+    deep-copies the definitions, so each study has its own copies), and
+    dummy data expectations are ignored
+    """
+    def freeze(value):
+        if isinstance(value, dict):
+            return tuple(
+                (key, freeze(item))
+                for key, item in sorted(value.items(), key=lambda pair: str(pair[0]))
+                if key != "return_expectations"
+            )
+        if hasattr(value, "system"):
+            return ("codelist", value.system, tuple(value))
+        if isinstance(value, (list, tuple)):
+            return tuple(freeze(item) for item in value)
+        return repr(value)
+
+    return (query_type, freeze(arguments))
+
+
+def date_references(arguments):
+    """
+    the references (variable names, "index_date", "today") in the date
+    expressions of a variable's arguments, ignoring literal dates
+    """
+    references = set()
+    for argument in date_arguments:
+        values = arguments.get(argument)
+        for value in values if isinstance(values, (list, tuple)) else [values]:
+            match = date_expression_pattern.match(value) if isinstance(value, str) else None
+            if match and not re.match(r"\d{4}-\d{2}-\d{2}$", match.group("reference")):
+                references.add(match.group("reference"))
+    return references
+
+
+def variable_references(query_type, arguments):
+    """
+    names of the other variables (and "index_date") a variable depends on,
+    through its dates, category expressions, aggregated columns or source
+    """
+    references = date_references(arguments) - fixed_date_references
+    for name in arguments.get("column_names") or []:
+        references.add(name)
+    if query_type == "value_from":
+        references.add(arguments["source"])
+    for expression in (arguments.get("category_definitions") or {}).values():
+        if expression.strip() != "DEFAULT":
+            references |= referenced_columns(parse(expression))
+    return references
+
+
+def classify_variables(variables):
+    """
+    classify every variable as "static", if it only depends on fixed dates,
+    or "dynamic", if it depends on dates that are specific to the patient or
+    the study: the study's index_date, dates read from a file (such as
+    index_date_cohort) or other dynamic variables
+    """
+    classes = {}
+
+    def classify(name):
+        if name not in classes:
+            if name not in variables:
+                # index_date, or a column this study does not define
+                return "dynamic"
+            classes[name] = "dynamic"
+            query_type, arguments = variables[name]
+            if query_type == "with_value_from_file":
+                static = arguments.get("returning_type") != "date"
+            else:
+                static = all(
+                    classify(reference) == "static"
+                    for reference in variable_references(query_type, arguments)
+                )
+            classes[name] = "static" if static else "dynamic"
+        return classes[name]
+
+    for name in variables:
+        classify(name)
+    return classes
+
+
+def dependent_definition_keys(variables):
+    """
+    {name: key} for every variable, where the key covers the variable's own
+    definition and those of all the variables it depends on, so equal keys
+    in two studies mean equal values
+    """
+    keys = {}
+
+    def key_of(name):
+        if name not in variables:
+            return ("undefined", name)
+        if name not in keys:
+            keys[name] = ("cycle", name)
+            query_type, arguments = variables[name]
+            references = sorted(variable_references(query_type, arguments))
+            keys[name] = (
+                definition_key(query_type, arguments),
+                tuple((reference, key_of(reference)) for reference in references),
+            )
+        return keys[name]
+
+    for name in variables:
+        key_of(name)
+    return keys
+
+
+def dependency_graph(variables):
+    """
+    {name: set of the names it depends on} for every variable; references to
+    names that are not variables of the study (such as index_date) are left
+    out
+    """
+    return {
+        name: {reference for reference in variable_references(query_type, arguments) if reference in variables}
+        for name, (query_type, arguments) in variables.items()
+    }
+
+
+def topological_levels(graph):
+    """
+    group the variables of a dependency graph into levels, each depending
+    only on variables in earlier levels, keeping the definition order
+    within a level
+    """
+    levels = []
+    done = set()
+    remaining = list(graph)
+    while remaining:
+        level = [name for name in remaining if graph[name] <= done]
+        if not level:
+            raise ValueError(f"Circular references between variables {sorted(remaining)}")
+        levels.append(level)
+        done.update(level)
+        remaining = [name for name in remaining if name not in done]
+    return levels
+
+
+def temporary_variables(variables, keep_prefixes=()):
+    """
+    names of the tmp_* variables that only feed other variables (e.g. the
+    _snomed/_hes/_death sources of a minimum_of()), other than those starting
+    with one of keep_prefixes
+    """
+    graph = dependency_graph(variables)
+    referenced = set().union(*graph.values()) if graph else set()
+    return {
+        name
+        for name in graph
+        if name.startswith("tmp_") and name in referenced and not name.startswith(tuple(keep_prefixes))
+    }
+
+
+def unneeded_variables(variables, excluded):
+    """
+    names of the variables that need not be evaluated when the variables in
+    excluded are not written: those no written variable depends on
+    """
+    graph = dependency_graph(variables)
+    hidden = hidden_variables(variables)
+    needed = set()
+    pending = [name for name in variables if name not in excluded and name not in hidden]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(graph[name])
+    return set(graph) - needed
@@ -0,0 +1,188 @@
+# Vectorised per-patient window kernels
+#
+# Most variables are first-match or last-match queries in a window specific
+# to each patient, e.g. between=[index_date_cohort, end_date_outcome] or
+# on_or_before="index_date_cohort - 1 day". Given events sorted by
+# (patient, date) and one pair of window bounds per patient, the kernel
+# returns the first/last matching event, count and flag for every patient in
+# one batched operation, without looping over patients in Python.
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from event_store import maximum_date, missing_date
+from value_files import load_value_file
+
+# Position used for patients without a matching event
+no_match = -1
+
+
+@dataclass
+class WindowMatches:
+    """
+    per-patient result of a windowed match: the index of the first and last
+    matching event (no_match if none) and the number of matching events
+    """
+
+    first: np.ndarray
+    last: np.ndarray
+    count: np.ndarray
+
+    @property
+    def flag(self):
+        return (self.count > 0).astype(np.int64)
+
+    def dates(self, event_dates, last=False):
+        """
+        date of the first (or last) matching event, missing_date if none
+        """
+        return self.values(event_dates, missing_date, last=last)
+
+    def values(self, event_values, empty, last=False):
+        """
+        value of a column for the first (or last) matching event of each
+        patient, empty if none
+        """
+        positions = self.last if last else self.first
+        found = positions != no_match
+        event_values = np.asarray(event_values)
+        result = np.full(len(positions), empty, dtype=object if isinstance(empty, str) else event_values.dtype)
+        result[found] = event_values[positions[found]]
+        return result
+
+
+def windowed_matches(event_rows, event_dates, mask, low, high, size):
+    """
+    match events against per-patient windows
+
+    event_rows: row of each event's patient, sorted ascending (with dates
+        ascending within each patient)
+    event_dates: int32 day of each event
+    mask: boolean array of the events eligible to match (e.g. by code)
+    low, high: per-patient window bounds (inclusive), scalars, or None for
+        an open end
+    size: number of patients
+    """
+    return windowed_matches_many(event_rows, event_dates, mask, [(low, high)], size)[0]
+
+
+def windowed_matches_many(event_rows, event_dates, mask, windows, size, first_only=False):
+    """
+    match events against several sets of per-patient windows, e.g. one per
+    cohort, in one pass: the eligible events are selected once and each is
+    compared with every window; returns one WindowMatches per window
+
+    With first_only, windows that start on the same dates (e.g. a cohort and
+    its extended follow-up variant) are matched once against their latest
+    end dates and the first matches of each window found by clipping; such
+    matches carry first matches and flags only.
+    """
+    selected = np.flatnonzero(mask)
+    selected_rows = event_rows[selected]
+    selected_dates = event_dates[selected] if event_dates is not None else None
+    if not first_only:
+        return [
+            matches_in_window(selected, selected_rows, selected_dates, low, high, size)
+            for low, high in windows
+        ]
+    results = [None] * len(windows)
+    for group in windows_by_start(windows):
+        low = windows[group[0]][0]
+        highs = [windows[position][1] for position in group]
+        if len(group) == 1:
+            results[group[0]] = matches_in_window(selected, selected_rows, selected_dates, low, highs[0], size)
+            continue
+        if any(high is None for high in highs):
+            longest = None
+        else:
+            longest = np.maximum.reduce([np.broadcast_to(high, (size,)) for high in highs])
+        matches = matches_in_window(selected, selected_rows, selected_dates, low, longest, size)
+        for position, high in zip(group, highs):
+            results[position] = clip_first_matches(matches, event_dates, high, size)
+    return results
+
+
+def windows_by_start(windows):
+    """
+    positions of the windows grouped by identical start dates
+    """
+    groups = []
+    for position, (low, _) in enumerate(windows):
+        for group in groups:
+            if same_bounds(windows[group[0]][0], low):
+                group.append(position)
+                break
+        else:
+            groups.append([position])
+    return groups
+
+
+def same_bounds(a, b):
+    """
+    whether two window bounds (arrays, scalars or None) are the same
+    """
+    if a is None or b is None:
+        return a is None and b is None
+    return a is b or np.array_equal(np.broadcast_to(a, np.shape(b)), b)
+
+
+def clip_first_matches(matches, event_dates, high, size):
+    """
+    first matches within a shorter window, given the first matches within a
+    window with the same start and a later (or equal) end: a patient's first
+    match is kept only if it falls on or before the new end
+    """
+    if high is None:
+        first = matches.first.copy()
+    else:
+        high = np.broadcast_to(high, (size,))
+        found = matches.first != no_match
+        found[found] = event_dates[matches.first[found]] <= high[found]
+        first = np.where(found, matches.first, no_match)
+    return WindowMatches(first=first, last=None, count=(first != no_match).astype(np.int64))
+
+
+def matches_in_window(selected, selected_rows, selected_dates, low, high, size):
+    """
+    first/last match and count per patient of the selected events (indices,
+    patient rows and dates) that fall within one set of windows
+    """
+    in_window = np.ones(len(selected), dtype=bool)
+    if low is not None:
+        # a patient whose window has a missing start matches nothing
+        low = np.broadcast_to(np.where(low == missing_date, maximum_date, low), (size,))
+        in_window &= selected_dates >= low[selected_rows]
+    if high is not None:
+        high = np.broadcast_to(high, (size,))
+        in_window &= selected_dates <= high[selected_rows]
+    matched = selected[in_window]
+    matched_rows = selected_rows[in_window]
+
+    first = np.full(size, no_match, dtype=np.int64)
+    last = np.full(size, no_match, dtype=np.int64)
+    if len(matched):
+        # events are grouped by patient, so a patient's first (last) match is
+        # where the patient row differs from the previous (next) match
+        starts = np.empty(len(matched), dtype=bool)
+        starts[0] = True
+        np.not_equal(matched_rows[1:], matched_rows[:-1], out=starts[1:])
+        ends = np.empty(len(matched), dtype=bool)
+        ends[-1] = True
+        ends[:-1] = starts[1:]
+        first[matched_rows[starts]] = matched[starts]
+        last[matched_rows[ends]] = matched[ends]
+    count = np.bincount(matched_rows, minlength=size).astype(np.int64)
+    return WindowMatches(first=first, last=last, count=count)
+
+
+def window_bounds_from_file(path, patient_ids, low_column, high_column):
+    """
+    per-patient window bounds read from two date columns of a file such as
+    output/index_dates.csv.gz, aligned with patient_ids (missing_date for
+    patients not in the file)
+    """
+    value_file = load_value_file(path)
+    return tuple(
+        value_file.aligned_column(column, patient_ids, "date") for column in (low_column, high_column)
+    )
@@ -0,0 +1,22 @@
+# The analysis/ modules import each other by name, as they do when
+# cohortextractor runs them, so the tests import them from analysis/ too;
+# codelists are read from paths relative to the project root
+import os
+import sys
+
+import pytest
+
+project_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_directory, "analysis"))
+
+
+@pytest.fixture
+def project_root(monkeypatch):
+    """
+    run the test from the project root, without the codelist cache
+    """
+    import codelists
+
+    monkeypatch.chdir(project_directory)
+    monkeypatch.setattr(codelists, "codelist_cache_dir", "")
+    return project_directory
@@ -0,0 +1,81 @@
+# The local engine resolves the categorised_as() dictionaries built by
+# study_definition_helper_functions.py directly; each shortcut must give the
+# categories that evaluating the dictionary's expressions gives
+
+import numpy as np
+import pytest
+
+from expressions import bucket_by_cutpoints, evaluate_categories, resolve_ethnicity
+from study_definition_helper_functions import (
+    deprivation_dictionary_ntiles,
+    deprivation_ntile_cutpoints,
+    ethnicity_dictionary_groups,
+    generate_deprivation_ntile_dictionary,
+    generate_ethnicity_dictionary,
+)
+
+size = 5_000
+
+ethnicity_columns = [
+    "cov_ethnicity_sus",
+    "cov_ethnicity_gp_opensafely",
+    "cov_ethnicity_gp_primis",
+    "cov_ethnicity_gp_opensafely_date",
+    "cov_ethnicity_gp_primis_date",
+]
+
+
+def ethnicity_sources(seed, values):
+    rng = np.random.default_rng(seed)
+    columns = {name: rng.choice(values, size).astype(object) for name in ethnicity_columns}
+    kinds = {name: "str" for name in ethnicity_columns}
+    return columns, kinds
+
+
+@pytest.mark.parametrize("n_groups", [5, 6, 16])
+@pytest.mark.parametrize("seed", [1, 2])
+def test_resolved_ethnicity_matches_the_dictionary(n_groups, seed):
+    # groups, none recorded, and categories outside the groups
+    values = [""] * 3 + [str(n) for n in range(1, n_groups + 1)] + ["0", "17"]
+    columns, kinds = ethnicity_sources(seed, values)
+    expected = evaluate_categories(generate_ethnicity_dictionary(n_groups), columns, kinds, size)
+    assert resolve_ethnicity(n_groups, columns, kinds, size).tolist() == expected.tolist()
+
+
+def test_sus_group_is_used_only_when_neither_gp_source_is_recorded():
+    columns = {
+        "cov_ethnicity_sus": np.array(["3", "3", "3"], dtype=object),
+        "cov_ethnicity_gp_opensafely": np.array(["", "1", ""], dtype=object),
+        "cov_ethnicity_gp_primis": np.array(["", "", "2"], dtype=object),
+        "cov_ethnicity_gp_opensafely_date": np.array(["", "1", ""], dtype=object),
+        "cov_ethnicity_gp_primis_date": np.array(["", "", "2"], dtype=object),
+    }
+    kinds = {name: "str" for name in ethnicity_columns}
+    assert resolve_ethnicity(6, columns, kinds, 3).tolist() == ["3", "1", "2"]
+
+
+def test_ethnicity_dictionary_is_recognised():
+    assert ethnicity_dictionary_groups(generate_ethnicity_dictionary(6)) == 6
+    edited = generate_ethnicity_dictionary(6)
+    edited["6"] = "cov_ethnicity_sus = '6'"
+    assert ethnicity_dictionary_groups(edited) == 0
+
+
+@pytest.mark.parametrize("ntiles", [3, 5, 7, 10])
+def test_bucketed_deprivation_matches_the_dictionary(ntiles):
+    rng = np.random.default_rng(ntiles)
+    # every value near a category boundary, 0 (missing) and the maximum,
+    # and random values
+    boundaries = [1] + [32844 * n / ntiles for n in range(1, ntiles + 1)]
+    near = [int(bound) + offset for bound in boundaries for offset in (-1, 0, 1)]
+    imd = np.concatenate([np.array(near + [0, 32844, 32845]), rng.integers(0, 32845, size)])
+    columns, kinds = {"index_of_multiple_deprivation": imd}, {"index_of_multiple_deprivation": "int"}
+    expected = evaluate_categories(generate_deprivation_ntile_dictionary(ntiles), columns, kinds, len(imd))
+    assert bucket_by_cutpoints(imd, deprivation_ntile_cutpoints(ntiles)).tolist() == expected.tolist()
+
+
+def test_deprivation_dictionary_is_recognised():
+    assert deprivation_dictionary_ntiles(generate_deprivation_ntile_dictionary(5)) == 5
+    edited = generate_deprivation_ntile_dictionary(5)
+    edited["5"] = "index_of_multiple_deprivation >= 30000"
+    assert deprivation_dictionary_ntiles(edited) == 0
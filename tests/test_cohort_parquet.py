@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+from cohort_parquet import parquet_table, text_table, write_parquet
+from event_store import date_to_days, days_to_dates, missing_date
+
+
+def typed_columns():
+    """
+    columns as the engine holds them, {name: (kind, values, date format)},
+    with their schema types
+    """
+    dates = np.array([date_to_days("2021-03-01"), missing_date, date_to_days("2020-12-31"), missing_date], dtype=np.int32)
+    columns = {
+        "patient_id": ("int", np.array([9, 3, 6, 12]), None),
+        "out_date_depression": ("date", dates, "YYYY-MM-DD"),
+        "vax_date_month": ("date", dates, "YYYY-MM"),
+        "vax_date_year": ("date", dates, "YYYY"),
+        "cov_bin_diabetes": ("int", np.array([1, 0, 0, 1]), None),
+        "cov_num_age": ("int", np.array([54, 0, 91, 17]), None),
+        "cov_num_bmi": ("float", np.array([27.5, 0.0, 31.25, 19.0]), None),
+        "cov_cat_sex": ("str", np.array(["F", "M", "", "F"], dtype=object), None),
+        "cov_cat_care_home": ("str", np.array(["TRUE", "FALSE", "FALSE", ""], dtype=object), None),
+    }
+    types = {
+        "out_date_depression": "date",
+        "vax_date_month": "character",
+        "vax_date_year": "integer",
+        "cov_bin_diabetes": "logical",
+        "cov_num_age": "integer",
+        "cov_num_bmi": "double",
+        "cov_cat_sex": "character",
+        "cov_cat_care_home": "logical",
+    }
+    return columns, types
+
+
+def text_columns(columns):
+    """
+    the columns as the engine writes them to CSV
+    """
+    return {
+        name: days_to_dates(values, date_format) if kind == "date" else values.astype(str).astype(object)
+        for name, (kind, values, date_format) in columns.items()
+    }
+
+
+def test_typed_columns_give_the_table_of_their_text():
+    columns, types = typed_columns()
+    assert parquet_table(columns, types).equals(text_table(text_columns(columns), types))
+
+
+def test_table_is_typed_by_the_schema_and_sorted_by_patient_id():
+    columns, types = typed_columns()
+    table = parquet_table(columns, types)
+    assert table.column("patient_id").to_pylist() == [3, 6, 9, 12]
+    assert table.schema.field("out_date_depression").type == pa.date32()
+    assert table.schema.field("vax_date_year").type == pa.int64()
+    assert table.schema.field("cov_bin_diabetes").type == pa.bool_()
+    assert table.schema.field("cov_num_bmi").type == pa.float64()
+    assert pa.types.is_dictionary(table.schema.field("cov_cat_sex").type)
+    assert table.column("out_date_depression").null_count == 2
+    assert table.column("cov_cat_care_home").to_pylist() == [False, False, True, None]
+
+
+def test_parquet_file_reads_back_as_the_table(tmp_path):
+    columns, types = typed_columns()
+    path = str(tmp_path / "input_vax.parquet")
+    write_parquet(columns, types, path)
+    assert pq.read_table(path).equals(parquet_table(columns, types))
@@ -0,0 +1,189 @@
+import numpy as np
+import pytest
+
+import expressions
+from event_store import date_to_days, days_to_dates, missing_date
+from expressions import ExpressionError, evaluate, evaluate_categories, parse, referenced_columns, tokenize
+
+
+def test_keywords_are_tokenized_in_any_case():
+    assert tokenize("a and NOT b Or c") == [
+        ("name", "a"),
+        ("keyword", "AND"),
+        ("keyword", "NOT"),
+        ("name", "b"),
+        ("keyword", "OR"),
+        ("name", "c"),
+    ]
+
+
+def test_literals_and_operators_are_tokenized():
+    assert tokenize("x<>'N' AND y>=32844*1/10") == [
+        ("name", "x"),
+        ("operator", "<>"),
+        ("string", "'N'"),
+        ("keyword", "AND"),
+        ("name", "y"),
+        ("operator", ">="),
+        ("number", "32844"),
+        ("operator", "*"),
+        ("number", "1"),
+        ("operator", "/"),
+        ("number", "10"),
+    ]
+
+
+def test_not_binds_tighter_than_and_tighter_than_or():
+    assert parse("NOT a OR b AND c") == (
+        "or",
+        ("not", ("column", "a")),
+        ("and", ("column", "b"), ("column", "c")),
+    )
+
+
+def test_parentheses_group():
+    assert parse("(a OR b) AND c") == (
+        "and",
+        ("or", ("column", "a"), ("column", "b")),
+        ("column", "c"),
+    )
+
+
+def test_arithmetic_binds_tighter_than_comparison():
+    assert parse("x < 1 + 2 * 3") == (
+        "compare",
+        "<",
+        ("column", "x"),
+        ("arithmetic", "+", ("literal", 1, "int"), ("arithmetic", "*", ("literal", 2, "int"), ("literal", 3, "int"))),
+    )
+
+
+def test_not_equal_is_normalised_and_literals_are_typed():
+    assert parse("x <> 'N'") == ("compare", "!=", ("column", "x"), ("literal", "N", "str"))
+    assert parse('x != "N"') == ("compare", "!=", ("column", "x"), ("literal", "N", "str"))
+    assert parse("x = 2.5") == ("compare", "=", ("column", "x"), ("literal", 2.5, "float"))
+
+
+@pytest.mark.parametrize("expression", ["a AND", "(a OR b", "a b", "a = 'N", "a ? b", "a OR )"])
+def test_malformed_expressions_are_rejected(expression):
+    with pytest.raises(ExpressionError):
+        parse(expression)
+
+
+def test_expressions_are_parsed_once_per_text():
+    assert parse("a AND b") is parse("a AND b")
+    # whitespace inside string literals is significant
+    assert parse("x = 'a b'") != parse("x = 'a  b'")
+
+
+def test_referenced_columns():
+    assert referenced_columns(parse("(NOT dmres_date AND diab_date) OR (dmres_date < diab_date)")) == {
+        "dmres_date",
+        "diab_date",
+    }
+    assert referenced_columns(parse("x > 32844*1/10 AND y = 'N'")) == {"x", "y"}
+
+
+def test_unknown_column_is_an_error():
+    with pytest.raises(ExpressionError):
+        evaluate("no_such_column", {}, {}, 1)
+
+
+# Random columns, and the same values as cohortextractor's SQL sees them:
+# dates as YYYY-MM-DD text ('' if missing), numbers, and strings
+size = 500
+kinds = {
+    "diab_date": "date",
+    "dmres_date": "date",
+    "smoking_code": "str",
+    "ever_smoked": "int",
+    "index_of_multiple_deprivation": "int",
+    "bmi": "float",
+}
+
+
+@pytest.fixture(scope="module")
+def columns():
+    rng = np.random.default_rng(1)
+
+    def dates():
+        days = rng.integers(date_to_days("2018-01-01"), date_to_days("2022-01-01"), size).astype(np.int32)
+        return np.where(rng.random(size) < 0.4, missing_date, days).astype(np.int32)
+
+    return {
+        "diab_date": dates(),
+        "dmres_date": dates(),
+        "smoking_code": rng.choice(["S", "E", "N", "M", ""], size).astype(object),
+        "ever_smoked": rng.integers(0, 2, size),
+        "index_of_multiple_deprivation": rng.integers(0, 32845, size),
+        "bmi": np.round(rng.normal(27, 6, size), 1),
+    }
+
+
+def reference_rows(columns):
+    text = {
+        name: days_to_dates(values) if kinds[name] == "date" else values for name, values in columns.items()
+    }
+    return [{name: values[row] for name, values in text.items()} for row in range(size)]
+
+
+def reference(expression, row):
+    """
+    an expression evaluated for one row by Python itself, after rewriting it
+    into Python syntax (every division in the expressions below is of
+    integers)
+    """
+    words = {"AND": " and ", "OR": " or ", "NOT": " not ", "=": "==", "<>": "!=", "/": "//"}
+    source = "".join(words.get(value, f" {value} ") for kind, value in tokenize(expression))
+    return bool(eval(source, {}, dict(row)))
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "(NOT dmres_date AND diab_date) OR (dmres_date < diab_date)",
+        "diab_date AND dmres_date >= diab_date",
+        "diab_date > '2020-03-01' AND NOT dmres_date",
+        "diab_date = ''",
+        "smoking_code = 'N' AND NOT ever_smoked",
+        "smoking_code = 'S' OR smoking_code = 'E' OR (smoking_code = 'N' AND ever_smoked)",
+        "smoking_code <> 'M' AND NOT smoking_code = ''",
+        "index_of_multiple_deprivation >=32844*1/10 AND index_of_multiple_deprivation < 32844*2/10",
+        "index_of_multiple_deprivation - 100 > 32844/2 OR -index_of_multiple_deprivation > -1000",
+        "bmi >= 30 AND bmi < 40.5",
+        "NOT (bmi < 18.5 OR bmi >= 25) AND ever_smoked = 1",
+    ],
+)
+def test_compiled_expressions_agree_with_row_by_row_evaluation(expression, columns):
+    expected = [reference(expression, row) for row in reference_rows(columns)]
+    assert evaluate(expression, columns, kinds, size).tolist() == expected
+
+
+def test_literal_only_expressions_are_broadcast():
+    assert evaluate("1 = 1", {}, {}, 3).tolist() == [True, True, True]
+    assert evaluate("2 < 1", {}, {}, 3).tolist() == [False, False, False]
+
+
+def test_categories_take_the_first_matching_expression_else_the_default(columns):
+    definitions = {
+        "S": "smoking_code = 'S'",
+        "E": "smoking_code = 'E' OR smoking_code = 'S'",
+        "N": "smoking_code = 'N'",
+        "M": "DEFAULT",
+    }
+    codes = columns["smoking_code"]
+    expected = np.where(np.isin(codes, ["S", "E", "N"]), codes, "M")
+    assert evaluate_categories(definitions, columns, kinds, size).tolist() == expected.tolist()
+
+
+def test_without_a_default_unmatched_patients_get_the_empty_category(columns):
+    values = evaluate_categories({"1": "ever_smoked"}, columns, kinds, size)
+    assert values.tolist() == np.where(columns["ever_smoked"] == 1, "1", "").tolist()
+
+
+def test_compiled_expressions_are_cached_on_their_text():
+    expressions.compile_expression("ever_smoked AND bmi > 30")
+    assert "ever_smoked AND bmi > 30" in expressions.compiled_expressions
+    assert expressions.compile_expression("ever_smoked AND bmi > 30") is expressions.compile_expression(
+        "ever_smoked AND bmi > 30"
+    )
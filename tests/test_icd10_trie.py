@@ -0,0 +1,72 @@
+import re
+
+import numpy as np
+
+from codelists import load_codelist
+from icd10_trie import ICD10Trie, build_icd10_trie
+
+
+def make_trie(**codelists):
+    trie = ICD10Trie()
+    for name, codes in codelists.items():
+        trie.add_codelist(name, codes)
+    return trie
+
+
+def test_codelist_code_matches_recorded_codes_it_prefixes():
+    trie = make_trie(depression=["F32", "F33"], hypertension=["I10"])
+    assert trie.match("F320") == {"depression"}
+    assert trie.match("F32X") == {"depression"}
+    assert trie.match("F32") == {"depression"}
+    assert trie.match("I10X") == {"hypertension"}
+
+
+def test_longer_codelist_code_does_not_match_shorter_recorded_code():
+    trie = make_trie(single_episode=["F320"])
+    assert trie.match("F32") == set()
+    assert trie.match("F321") == set()
+
+
+def test_code_must_match_from_its_start():
+    trie = make_trie(depression=["F32"])
+    assert trie.match("XF32") == set()
+    assert trie.match("AF320") == set()
+
+
+def test_every_code_of_a_diagnosis_string_is_matched():
+    trie = make_trie(depression=["F32"], hypertension=["I10"], pneumonia=["J12"], asthma=["J45"])
+    assert trie.match("||F320 ,I10X ,Z864 ||J128") == {"depression", "hypertension", "pneumonia"}
+
+
+def test_codes_are_matched_ignoring_case_and_surrounding_whitespace():
+    trie = make_trie(depression=[" f32 "])
+    assert trie.match("f320") == {"depression"}
+    assert trie.match("x10, F32X") == {"depression"}
+
+
+def test_match_all_aligns_masks_with_the_input():
+    trie = make_trie(depression=["F32"], hypertension=["I10"])
+    masks = trie.match_all(["F320", "", "I10X,F329", "Z864", "F320"])
+    assert masks["depression"].tolist() == [True, False, True, False, True]
+    assert masks["hypertension"].tolist() == [False, False, True, False, False]
+
+
+def test_project_codelists_match_as_prefixes(project_root):
+    trie = build_icd10_trie()
+    assert trie.names
+    codes = {name: [code.strip().upper() for code in load_codelist(name)] for name in trie.names}
+    rng = np.random.default_rng(1)
+    every_code = sorted({code for values in codes.values() for code in values})
+    # codes recorded in full, extended by a character, cut short, and mixed
+    # with codes from no codelist
+    recorded = every_code + [code + "X" for code in every_code] + [code[:-1] for code in every_code] + ["Z864", "R69"]
+    diagnoses = ["||".join(rng.choice(recorded, 3)) for _ in range(2_000)]
+    for diagnosis in diagnoses:
+        recorded_codes = [code for code in re.split(r"[^A-Za-z0-9]+", diagnosis.upper()) if code]
+        expected = {
+            name
+            for name, values in codes.items()
+            if any(code.startswith(value) for code in recorded_codes for value in values)
+        }
+        assert trie.match(diagnosis) == expected, diagnosis
+
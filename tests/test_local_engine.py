@@ -0,0 +1,50 @@
+import csv
+import gzip
+
+import numpy as np
+
+from local_engine import write_csv
+
+
+def cohort_columns():
+    return {
+        "patient_id": np.array(["3", "6", "9"], dtype=object),
+        "cov_cat_sex": np.array(["F", "M", ""], dtype=object),
+        "cov_cat_region": np.array(["North West", "London, City", 'a "quoted" name'], dtype=object),
+    }
+
+
+def read_rows(opener, path):
+    with opener(path, "rt", newline="") as f:
+        return list(csv.reader(f))
+
+
+def expected_rows(columns):
+    return [list(columns)] + [list(row) for row in zip(*columns.values())]
+
+
+def test_gzipped_cohort_reads_back_unchanged(tmp_path):
+    columns = cohort_columns()
+    path = str(tmp_path / "input_vax.csv.gz")
+    write_csv(columns, path)
+    with open(path, "rb") as f:
+        assert f.read(2) == b"\x1f\x8b"
+    assert read_rows(gzip.open, path) == expected_rows(columns)
+
+
+def test_plain_cohort_is_not_gzipped(tmp_path):
+    columns = cohort_columns()
+    path = str(tmp_path / "input_vax.csv")
+    write_csv(columns, path)
+    assert read_rows(open, path) == expected_rows(columns)
+
+
+def test_gzipped_cohort_reads_back_with_many_rows(tmp_path):
+    size = 200_000
+    columns = {
+        "patient_id": np.arange(size).astype(str).astype(object),
+        "out_date_depression": np.where(np.arange(size) % 7 == 0, "2021-03-01", "").astype(object),
+    }
+    path = str(tmp_path / "input_vax.csv.gz")
+    write_csv(columns, path)
+    assert read_rows(gzip.open, path) == expected_rows(columns)